@@ -0,0 +1,466 @@
+"""Benchmarks for the car lending database.
+
+    python benchmark.py profiles [--rows N] [--reads N] [--json FILE]
+    python benchmark.py startup [--runs N] [--json FILE]
+    python benchmark.py suite [--scale 10k|1m|10m] [--data-dir DIR] [--baseline FILE] [--json FILE]
+
+"profiles" compares the connection profiles of car_lending.CONNECTION_PROFILES
+against the driver defaults: throughput of single-row autocommitted INSERTs
+(what save_new_record does) and read latency of the graph aggregation and of
+a table page. Every profile runs against its own fresh database file.
+
+"startup" measures cold starts in fresh interpreters (offscreen Qt platform):
+the time to import car_lending, the time until the main window first paints,
+and the slowest imports reported by python -X importtime.
+
+"suite" runs the GUI headless (offscreen Qt platform) against a synthetic
+dataset of the chosen scale: init_db, load_record_data and scroll-to-end
+per table, sorting lendings by date and scrolling the sorted view, update_graph_data, a full build of every chart type, and
+single-row (save_new_record) and bulk (import_records) write throughput.
+Datasets are generated once per scale and seed and reused from --data-dir.
+With --baseline, measurements more than --threshold worse than the baseline
+run (*_ms higher, *_per_s lower) are listed and the run fails.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from PyQt6.QtCore import QCoreApplication, Qt
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtSql import QSqlDatabase, QSqlQuery
+
+import car_lending
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def lending_rows(count, customers=1, cars=1):
+    first_day = datetime.date(2020, 1, 1)
+    for i in range(count):
+        day = first_day + datetime.timedelta(days=i % 1500)
+        yield (i % customers + 1, i % cars + 1, day.isoformat(), (day + datetime.timedelta(days=i % 14)).isoformat())
+
+def insert_single_rows(db, count):
+    query = QSqlQuery(db)
+    for row in lending_rows(count):
+        query.prepare("INSERT INTO lendings (customer_id, car_id, lending_date, return_date) VALUES (?, ?, ?, ?)")
+        for value in row:
+            query.addBindValue(value)
+        query.exec()
+
+def read_page(db):
+    query = QSqlQuery(db)
+    query.setForwardOnly(True)
+    query.prepare("SELECT * FROM lendings WHERE id > ? ORDER BY id LIMIT 256")
+    query.addBindValue(0)
+    query.exec()
+    while query.next():
+        pass
+
+def latency_ms(function, db, repeats):
+    samples = [timed(function, db) * 1000 for _ in range(repeats)]
+    return {"median_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+
+def bench_profile(profile, directory, rows, reads):
+    label = profile or "driver defaults"
+    name = f"bench_{label}"
+    db = car_lending.open_connection(name, os.path.join(directory, f"{label}.db"), profile)
+    car_lending.create_schema(db)
+    car_lending.migrate_db(db)
+    QSqlQuery("INSERT INTO customers (name, email) VALUES ('bench', 'bench@example.com')", db)
+    QSqlQuery("INSERT INTO cars (make, model, year) VALUES ('Bench', 'Car', 2020)", db)
+
+    elapsed = timed(insert_single_rows, db, rows)
+    result = {
+        "profile": label,
+        "insert_rows_per_s": round(rows / elapsed, 1),
+        "graph_aggregation": latency_ms(car_lending.query_lending_counts, db, reads),
+        "table_page": latency_ms(read_page, db, reads),
+    }
+    db.close()
+    del db
+    QSqlDatabase.removeDatabase(name)
+    return result
+
+def run_profiles(args):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in [""] + list(car_lending.CONNECTION_PROFILES):
+            result = bench_profile(profile, directory, args.rows, args.reads)
+            results.append(result)
+            print(f"{result['profile']:>16}: {result['insert_rows_per_s']:>10} inserts/s, "
+                  f"graph query {result['graph_aggregation']['median_ms']} ms, "
+                  f"table page {result['table_page']['median_ms']} ms (median)")
+    return results
+
+#run in a fresh interpreter, prints the timings as JSON
+FIRST_PAINT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import car_lending
+imported = time.perf_counter()
+from PyQt6.QtCore import QEvent, QObject
+from PyQt6.QtWidgets import QApplication
+
+class PaintWatcher(QObject):
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Paint:
+            print(json.dumps({"import_ms": (imported - start) * 1000, "first_paint_ms": (time.perf_counter() - start) * 1000}))
+            sys.stdout.flush()
+            app.exit(0)
+        return False
+
+app = QApplication(sys.argv[:1])
+window = car_lending.CarLendingApp()
+watcher = PaintWatcher()
+window.installEventFilter(watcher)
+window.show()
+app.exec()
+window.close()
+"""
+
+def probe_environment():
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH")]))
+    return env
+
+def slowest_imports(directory, count=10):
+    """Return the modules with the largest cumulative time in python -X importtime."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import car_lending"], cwd=directory, env=probe_environment(), capture_output=True, text=True, check=True).stderr
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.strip()))
+    total = max((cumulative for cumulative, name in imports if name == "car_lending"), default=0)
+    top = sorted(imports, reverse=True)[1:count + 1]
+    return total / 1000, [{"module": name, "cumulative_ms": cumulative / 1000} for cumulative, name in top]
+
+def run_startup(args):
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, "-c", FIRST_PAINT_PROBE], cwd=directory, env=probe_environment(), capture_output=True, text=True, timeout=120, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        importtime_ms, top_imports = slowest_imports(directory)
+
+    result = {
+        "runs": args.runs,
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "first_paint_ms": round(statistics.median(run["first_paint_ms"] for run in runs), 1),
+        "importtime_car_lending_ms": importtime_ms,
+        "slowest_imports": top_imports,
+    }
+    print(f"import car_lending: {result['import_ms']} ms, first paint: {result['first_paint_ms']} ms (median of {args.runs} cold starts)")
+    print("slowest imports (python -X importtime, cumulative):")
+    for entry in top_imports:
+        print(f"  {entry['cumulative_ms']:>9.1f} ms  {entry['module']}")
+    return result
+
+#suite dataset sizes: customers, cars, lendings
+SCALES = {
+    "10k": (1000, 100, 10_000),
+    "1m": (50_000, 2_000, 1_000_000),
+    "10m": (200_000, 10_000, 10_000_000),
+}
+MAKES = ["Toyota", "Ford", "Skoda", "Volkswagen", "Renault", "Kia", "Tesla", "BMW", "Fiat", "Volvo"]
+TABLES = ["customers", "cars", "lendings"]
+CHART_TYPES = ["Bar Chart", "Pie Chart", "Line Graph"]
+
+def insert_batches(db, sql, rows, chunk_size=50000):
+    query = QSqlQuery(db)
+    query.prepare(sql)
+    chunk = []
+
+    def flush():
+        for values in zip(*chunk):
+            query.addBindValue(list(values))
+        if not query.execBatch():
+            raise RuntimeError(query.lastError().text())
+        chunk.clear()
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+def synthetic_lendings(customers, cars, lendings, seed):
+    """Lendings spread round-robin over the cars; every car's lendings follow each other without overlapping."""
+    generator = random.Random(seed)
+    first_day = datetime.date(2000, 1, 1).toordinal()
+    for i in range(lendings):
+        start = first_day + (i // cars) * 4 + generator.randint(0, 1)
+        returned = start + generator.randint(1, 3)
+        yield (generator.randint(1, customers), i % cars + 1, datetime.date.fromordinal(start).isoformat(), datetime.date.fromordinal(returned).isoformat())
+
+def generate_dataset(path, scale, seed=1):
+    """Fill a new database with the rows of a scale, then let the migrations build the derived tables."""
+    customers, cars, lendings = SCALES[scale]
+    generator = random.Random(seed)
+    name = "bench_generate"
+    db = car_lending.open_connection(name, path, "bulk_import")
+    car_lending.create_schema(db)
+    db.transaction()
+    insert_batches(db, "INSERT INTO customers (id, name, email) VALUES (?, ?, ?)",
+                   ((i, f"Customer {i}", f"customer{i}@example.com") for i in range(1, customers + 1)))
+    insert_batches(db, "INSERT INTO cars (id, make, model, year) VALUES (?, ?, ?, ?)",
+                   ((i, generator.choice(MAKES), f"Model {i % 40}", 1995 + i % 30) for i in range(1, cars + 1)))
+    insert_batches(db, "INSERT INTO lendings (customer_id, car_id, lending_date, return_date) VALUES (?, ?, ?, ?)",
+                   synthetic_lendings(customers, cars, lendings, seed))
+    db.commit()
+    #indexes, search, rollup and availability tables are built in one pass each instead of row by row
+    car_lending.migrate_db(db)
+    db.close()
+    del db
+    QSqlDatabase.removeDatabase(name)
+
+def process_events(seconds=0.05):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        QApplication.processEvents()
+        time.sleep(0.005)
+
+def wait_for(condition, timeout=300):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise RuntimeError("timed out waiting for the GUI")
+        process_events(0.01)
+
+def median_ms(function, repeats, *args, before=None):
+    samples = []
+    for _ in range(repeats):
+        if before is not None:
+            before()
+        samples.append(timed(function, *args) * 1000)
+    return round(statistics.median(samples), 3)
+
+class AcceptingDialog:
+    """Stands in for the add dialog save_new_record closes."""
+    def accept(self):
+        pass
+
+    def reject(self):
+        raise RuntimeError("save_new_record rejected the benchmark row")
+
+def measure_app(path, scratch, repeats, writes, bulk_rows):
+    car_lending.DB_NAME = path
+    measurements = {}
+    start = time.perf_counter()
+    window = car_lending.CarLendingApp()
+    measurements["window_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    measurements["init_db_ms"] = round(car_lending.METRICS.snapshot()["timings"]["startup.init_db"]["last_s"] * 1000, 3)
+    window.resize(1400, 800)
+    window.show()
+    for index in (1, 2):
+        window.ensure_view(index)
+    window.stacked_layout.setCurrentIndex(2)
+    wait_for(lambda: window.graph_artists is not None)
+
+    for table in TABLES:
+        view = getattr(window, f"{table}_table")
+        model = window.get_model(table)
+        measurements[f"load_{table}_ms"] = median_ms(window.load_record_data, repeats, table)
+
+        #jumping from the top to the last row with no cached pages, until the rows are painted
+        def reset_view():
+            view.scrollToTop()
+            model.pages.clear()
+            view.viewport().repaint()
+
+        def scroll_to_end():
+            view.scrollToBottom()
+            view.viewport().repaint()
+
+        window.stacked_layout.setCurrentIndex(TABLES.index(table))
+        process_events()
+        measurements[f"scroll_to_end_{table}_ms"] = median_ms(scroll_to_end, repeats, before=reset_view)
+
+    #the same on lendings sorted by date, newest first, which should cost what the id order costs
+    view, model = window.lendings_table, window.get_model("lendings")
+    date_column = model.columns.index("lending_date")
+
+    def sort_by_id():
+        view.sortByColumn(model.id_column, Qt.SortOrder.AscendingOrder)
+
+    def sort_by_date():
+        view.sortByColumn(date_column, Qt.SortOrder.DescendingOrder)
+        view.viewport().repaint()
+
+    def reset_sorted_view():
+        view.scrollToTop()
+        model.pages.clear()
+        view.viewport().repaint()
+
+    def scroll_sorted_to_end():
+        view.scrollToBottom()
+        view.viewport().repaint()
+
+    measurements["sort_lendings_by_date_ms"] = median_ms(sort_by_date, repeats, before=sort_by_id)
+    measurements["scroll_to_end_sorted_lendings_ms"] = median_ms(scroll_sorted_to_end, repeats, before=reset_sorted_view)
+    sort_by_id()
+
+    window.stacked_layout.setCurrentIndex(2)
+    process_events()
+    measurements["update_graph_data_ms"] = median_ms(window.update_graph_data, repeats)
+
+    #the analytics: reading every lending into the snapshot once, then recomputing over all of them
+    snapshot = window.lending_snapshot
+    measurements["snapshot_load_ms"] = round(timed(snapshot.refresh, window.db, lambda message: None) * 1000, 3)
+    measurements["snapshot_analytics_ms"] = median_ms(snapshot.analytics, repeats, 1, datetime.date.today().toordinal())
+    for chart in CHART_TYPES:
+        window.graph_type_combo.blockSignals(True)
+        window.graph_type_combo.setCurrentText(chart)
+        window.graph_type_combo.blockSignals(False)
+
+        def rebuild():
+            window.graph_artists = None
+
+        measurements[f"show_lending_graph_{chart.split()[0].lower()}_ms"] = median_ms(window.show_lending_graph, repeats, chart, before=rebuild)
+
+    #single-row writes through save_new_record, on one car far after the generated history
+    def fail(title, text):
+        raise RuntimeError(f"{title}: {text}")
+    window.show_message = fail
+    first_day = datetime.date(2200, 1, 1).toordinal()
+    fields = ["customer_id", "car_id", "lending_date", "return_date"]
+    start = time.perf_counter()
+    for i in range(writes):
+        day = first_day + i * 2
+        window.save_new_record(AcceptingDialog(), "lendings", fields, [1, 1, datetime.date.fromordinal(day).isoformat(), datetime.date.fromordinal(day + 1).isoformat()])
+    window.writes.flush() #the last group commit is part of the cost
+    measurements["single_row_writes_per_s"] = round(writes / (time.perf_counter() - start), 1)
+    #only the new lendings are read, past the snapshot's id watermark
+    measurements["snapshot_refresh_after_writes_ms"] = round(timed(snapshot.refresh, window.db, lambda message: None) * 1000, 3)
+
+    #bulk writes through the streaming importer
+    bulk_path = os.path.join(scratch, "bulk.csv")
+    with open(bulk_path, "w", encoding="utf-8") as file:
+        file.write("customer_id,car_id,lending_date,return_date\n")
+        for i in range(bulk_rows):
+            day = datetime.date.fromordinal(first_day + 10000 + i // 100).isoformat()
+            file.write(f"1,2,{day},{day}\n")
+    summary = car_lending.import_records(window.db, "lendings", bulk_path, report=lambda message: None)
+    if summary["failed"]:
+        raise RuntimeError(f"bulk import failed: {summary['failed']}")
+    measurements["bulk_import_rows_per_s"] = summary["rows_per_s"]
+
+    window.close()
+    process_events()
+    return measurements
+
+def sqlite_version():
+    query = QSqlQuery("SELECT sqlite_version()", QSqlDatabase.database())
+    return query.value(0) if query.next() else None
+
+def run_suite(args):
+    customers, cars, lendings = SCALES[args.scale]
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.data_dir or scratch
+        os.makedirs(directory, exist_ok=True)
+        dataset = os.path.join(directory, f"bench_{args.scale}_seed{args.seed}.db")
+        generate_seconds = None
+        if not os.path.exists(dataset):
+            print(f"generating {args.scale} dataset ({customers} customers, {cars} cars, {lendings} lendings)...")
+            generate_seconds = round(timed(generate_dataset, dataset + ".partial", args.scale, args.seed), 3)
+            os.replace(dataset + ".partial", dataset)
+        #measuring on a copy, so the write benchmarks don't change the dataset
+        work = os.path.join(scratch, "work.db")
+        shutil.copyfile(dataset, work)
+        measurements = measure_app(work, scratch, args.repeats, args.writes, args.bulk_rows)
+        version = sqlite_version()
+
+    result = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "rows": {"customers": customers, "cars": cars, "lendings": lendings},
+        "repeats": args.repeats,
+        "generate_s": generate_seconds,
+        "sqlite": version,
+        "python": sys.version.split()[0],
+        "measurements": measurements,
+    }
+    print(f"{args.scale} dataset, median of {args.repeats}:")
+    for name, value in measurements.items():
+        print(f"  {name:>32}: {value}")
+    return result
+
+def find_regressions(result, baseline, threshold, min_delta_ms=0.0):
+    """Measurements more than threshold (a fraction) worse than in the baseline result.
+
+    Latencies also have to be min_delta_ms slower, so millisecond-scale noise doesn't fail a run.
+    """
+    regressions = []
+    previous = baseline.get("results", baseline).get("measurements", {})
+    for name, value in result["measurements"].items():
+        old = previous.get(name)
+        if not old:
+            continue
+        if name.endswith("_ms") and value > old * (1 + threshold) and value - old > min_delta_ms:
+            regressions.append(f"{name}: {old} -> {value} ms")
+        elif name.endswith("_per_s") and value < old * (1 - threshold):
+            regressions.append(f"{name}: {old} -> {value} per s")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Car lending database benchmarks")
+    parser.add_argument("--json", help="also write the results to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    profiles = commands.add_parser("profiles", help="compare connection profiles")
+    profiles.add_argument("--rows", type=int, default=2000, help="single-row inserts per profile")
+    profiles.add_argument("--reads", type=int, default=50, help="repetitions of each read")
+    profiles.set_defaults(run=run_profiles)
+
+    startup = commands.add_parser("startup", help="measure import time and time to first paint")
+    startup.add_argument("--runs", type=int, default=5, help="cold starts to take the median of")
+    startup.set_defaults(run=run_startup)
+
+    suite = commands.add_parser("suite", help="headless GUI and write benchmarks on a synthetic dataset")
+    suite.add_argument("--scale", choices=list(SCALES), default="10k", help="dataset size, in lendings")
+    suite.add_argument("--seed", type=int, default=1, help="seed of the synthetic data")
+    suite.add_argument("--data-dir", help="where generated datasets are kept and reused, a temporary directory by default")
+    suite.add_argument("--repeats", type=int, default=5, help="repetitions of each measurement")
+    suite.add_argument("--writes", type=int, default=200, help="single-row writes to time")
+    suite.add_argument("--bulk-rows", type=int, default=50000, help="rows of the bulk import")
+    suite.add_argument("--baseline", help="JSON results of an earlier suite run to compare against")
+    suite.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown against the baseline, as a fraction")
+    suite.add_argument("--min-delta-ms", type=float, default=2.0, help="latency changes smaller than this never count as regressions")
+    suite.set_defaults(run=run_suite, gui=True)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "gui", False):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+    else:
+        app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    results = args.run(args)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"command": args.command, "results": results}, file, indent=2)
+    if getattr(args, "baseline", None):
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"regressions beyond {args.threshold:.0%} of {args.baseline}:")
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print(f"no regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,66 +1,2045 @@
 import sys
+import os
+import csv
+import datetime
+import time
+import argparse
+import itertools
+import re
+import http.client
+import urllib.parse
+from collections import OrderedDict
+from contextlib import contextmanager
 from PyQt6 import QtCore
-import bcrypt
 import json
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
-from PyQt6 import QtSql
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtCore import Qt, QObject, QTimer, QThread, QMutex, QWaitCondition, pyqtSignal, QAbstractTableModel, QAbstractListModel, QModelIndex
 from PyQt6.QtSql import QSqlQuery, QSqlDatabase 
-from PyQt6.QtWidgets import QDateEdit, QApplication, QSpinBox, QWidget, QTableView, QHBoxLayout, QStackedLayout, QVBoxLayout, QLabel, QPushButton, QComboBox, QLineEdit, QAbstractItemView, QDialog, QSizePolicy, QHeaderView
-from matplotlib.figure import Figure
-from matplotlib import pyplot as plt
+from PyQt6.QtGui import QKeySequence, QShortcut
+from PyQt6.QtWidgets import QDateEdit, QApplication, QSpinBox, QWidget, QTableView, QHBoxLayout, QStackedLayout, QVBoxLayout, QLabel, QPushButton, QComboBox, QLineEdit, QAbstractItemView, QDialog, QSizePolicy, QHeaderView, QFileDialog, QProgressDialog, QCompleter, QListWidget
 import colorsys
-from matplotlib import colors as mcolors
+#matplotlib is imported when the lendings view is first shown, see init_lendings_view
+
+DB_NAME = "car_lending.db"
+DATE_FORMAT = "yyyy-MM-dd" #dates are stored as ISO text, so they sort chronologically
+
+#PRAGMAs applied to every connection right after it is opened
+CONNECTION_PROFILES = {
+    #GUI use: WAL lets the graph worker read while a dialog writes, NORMAL only syncs on checkpoints
+    "interactive": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024, #negative values are KiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    #large batched writes: bigger cache and map, fewer checkpoints interrupting the batches
+    "bulk_import": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 1024 * 1024 * 1024,
+        "cache_size": -256 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+        "wal_autocheckpoint": 10000,
+    },
+}
+DEFAULT_PROFILE = os.environ.get("CAR_LENDING_DB_PROFILE", "interactive")
+
+#lendings returned more days ago than this are moved to the archive db by the archive command
+ARCHIVE_AFTER_DAYS = int(os.environ.get("CAR_LENDING_ARCHIVE_DAYS", 365))
+
+#lending_service.py instance taking the GUI's writes (http://host:port), unset to write to the db directly
+SERVICE_URL = os.environ.get("CAR_LENDING_SERVICE_URL")
+
+#where the metrics are dumped (JSON, or Prometheus text for .prom/.txt files), unset to not dump them
+METRICS_FILE = os.environ.get("CAR_LENDING_METRICS_FILE")
+
+class Metrics:
+    """Wall time and row counts per named operation, plus event counters.
+
+    Shared by the GUI thread and the worker threads, so every update is
+    done under a mutex. Names are dotted: query.<table>.page, graph.draw, ...
+    """
+
+    def __init__(self):
+        self.mutex = QMutex()
+        self.timings = {} #name -> {"count", "total_s", "max_s", "last_s", "rows"}
+        self.counters = {} #name -> count
+        self.started = time.time()
+
+    def record(self, name, seconds, rows=None):
+        self.mutex.lock()
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = {"count": 0, "total_s": 0.0, "max_s": 0.0, "last_s": 0.0, "rows": 0}
+        timing["count"] += 1
+        timing["total_s"] += seconds
+        timing["max_s"] = max(timing["max_s"], seconds)
+        timing["last_s"] = seconds
+        if rows is not None:
+            timing["rows"] += rows
+        self.mutex.unlock()
+
+    def increment(self, name, amount=1):
+        self.mutex.lock()
+        self.counters[name] = self.counters.get(name, 0) + amount
+        self.mutex.unlock()
+
+    @contextmanager
+    def timer(self, name):
+        """Time a block; setting sample["rows"] inside it records the rows it returned."""
+        sample = {"rows": None}
+        start = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            self.record(name, time.perf_counter() - start, sample["rows"])
+
+    def snapshot(self):
+        self.mutex.lock()
+        timings = {name: dict(timing) for name, timing in self.timings.items()}
+        counters = dict(self.counters)
+        self.mutex.unlock()
+        return {"uptime_s": round(time.time() - self.started, 3), "timings": timings, "counters": counters}
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP car_lending_operation_seconds Wall time spent per operation.",
+            "# TYPE car_lending_operation_seconds summary",
+        ]
+        for name, timing in sorted(snapshot["timings"].items()):
+            lines.append(f'car_lending_operation_seconds_sum{{name="{name}"}} {timing["total_s"]:.6f}')
+            lines.append(f'car_lending_operation_seconds_count{{name="{name}"}} {timing["count"]}')
+        lines += ["# HELP car_lending_operation_max_seconds Slowest call per operation.", "# TYPE car_lending_operation_max_seconds gauge"]
+        lines += [f'car_lending_operation_max_seconds{{name="{name}"}} {timing["max_s"]:.6f}' for name, timing in sorted(snapshot["timings"].items())]
+        lines += ["# HELP car_lending_operation_rows_total Rows returned or written per operation.", "# TYPE car_lending_operation_rows_total counter"]
+        lines += [f'car_lending_operation_rows_total{{name="{name}"}} {timing["rows"]}' for name, timing in sorted(snapshot["timings"].items())]
+        lines += ["# HELP car_lending_events_total Counted events (model resets, failed writes, ...).", "# TYPE car_lending_events_total counter"]
+        lines += [f'car_lending_events_total{{name="{name}"}} {count}' for name, count in sorted(snapshot["counters"].items())]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write the metrics to path, as Prometheus text for .prom/.txt files and JSON otherwise."""
+        if os.path.splitext(path)[1].lower() in (".prom", ".txt"):
+            text = self.prometheus_text()
+        else:
+            text = json.dumps(self.snapshot(), indent=2)
+        #written next to the target and renamed, so a scraper never reads half a file
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(path + ".tmp", path)
+
+    def summary_lines(self, count=12):
+        """The operations with the most total time, one readable line each."""
+        snapshot = self.snapshot()
+        ranked = sorted(snapshot["timings"].items(), key=lambda item: item[1]["total_s"], reverse=True)[:count]
+        lines = [f"{name}: {timing['count']}x, last {timing['last_s'] * 1000:.1f} ms, max {timing['max_s'] * 1000:.1f} ms" + (f", {timing['rows']} rows" if timing["rows"] else "") for name, timing in ranked]
+        lines += [f"{name}: {count}" for name, count in sorted(snapshot["counters"].items())]
+        return lines
+
+METRICS = Metrics()
+
+def open_connection(connection_name=None, path=None, profile=None):
+    """Open a QSQLITE connection to the lending db, None if it can't be opened.
+
+    profile names an entry of CONNECTION_PROFILES (DEFAULT_PROFILE if not given),
+    an empty string keeps the driver defaults.
+    """
+    if connection_name is None:
+        db = QSqlDatabase.addDatabase("QSQLITE")
+    else:
+        db = QSqlDatabase.addDatabase("QSQLITE", connection_name)
+    db.setDatabaseName(path or DB_NAME)
+    if not db.open():
+        return None
+    #sqlite only enforces the FOREIGN KEY clauses when asked to, per connection
+    QSqlQuery("PRAGMA foreign_keys = ON", db)
+    apply_connection_profile(db, DEFAULT_PROFILE if profile is None else profile)
+    attach_archive(db)
+    return db
+
+def apply_connection_profile(db, profile):
+    if not profile:
+        return
+    if profile not in CONNECTION_PROFILES:
+        print(f"Unknown connection profile {profile!r}, using driver defaults")
+        return
+    query = QSqlQuery(db)
+    for pragma, value in CONNECTION_PROFILES[profile].items():
+        if not query.exec(f"PRAGMA {pragma} = {value}"):
+            print(f"Failed to set PRAGMA {pragma}:", query.lastError().text())
+
+def create_schema(db):
+    query = QSqlQuery(db)
+    query.exec("""
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            email TEXT
+        )
+    """)
+    query.exec("""
+        CREATE TABLE IF NOT EXISTS cars (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            make TEXT,
+            model TEXT,
+            year INTEGER
+        )
+    """)
+    query.exec("""
+        CREATE TABLE IF NOT EXISTS lendings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            car_id INTEGER,
+            lending_date TEXT,
+            return_date TEXT,
+            FOREIGN KEY(customer_id) REFERENCES customers(id),
+            FOREIGN KEY(car_id) REFERENCES cars(id)
+        )
+    """)
+
+#per-date lending counts, kept current by the lending_daily_counts triggers below
+LENDING_COUNTS_SQL = "SELECT lending_date, lendings FROM lending_daily_counts"
+#the same counts aggregated from the lendings, for databases below schema 5 without the rollup
+UNROLLED_LENDING_COUNTS_SQL = "SELECT lending_date, COUNT(*) FROM lendings WHERE lending_date IS NOT NULL GROUP BY lending_date"
+
+#rebuilding the rollup from scratch, for databases written around the triggers
+ROLLUP_REBUILD_STATEMENTS = [
+    "DELETE FROM lending_daily_counts",
+    """INSERT INTO lending_daily_counts (lending_date, lendings)
+       SELECT lending_date, COUNT(*) FROM lendings WHERE lending_date IS NOT NULL GROUP BY lending_date""",
+]
+
+#rollup tables are a row per day, reading them whole is the point
+ROLLUP_TABLES = {"lending_daily_counts"}
+
+def rollup_statements():
+    """Statements creating the daily lending rollup, its triggers and the weekly/monthly views."""
+    add = """INSERT INTO lending_daily_counts (lending_date, lendings) VALUES (new.lending_date, 1)
+             ON CONFLICT(lending_date) DO UPDATE SET lendings = lendings + 1;"""
+    remove = """UPDATE lending_daily_counts SET lendings = lendings - 1 WHERE lending_date = old.lending_date;
+                DELETE FROM lending_daily_counts WHERE lending_date = old.lending_date AND lendings <= 0;"""
+    return [
+        """CREATE TABLE IF NOT EXISTS lending_daily_counts (
+               lending_date TEXT PRIMARY KEY,
+               lendings INTEGER NOT NULL
+           ) WITHOUT ROWID""",
+        f"CREATE TRIGGER IF NOT EXISTS lending_counts_insert AFTER INSERT ON lendings WHEN new.lending_date IS NOT NULL BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS lending_counts_delete AFTER DELETE ON lendings WHEN old.lending_date IS NOT NULL BEGIN {remove} END",
+        #an edit moving a lending to another day takes it off the old date first
+        f"""CREATE TRIGGER IF NOT EXISTS lending_counts_update_old AFTER UPDATE OF lending_date ON lendings
+            WHEN old.lending_date IS NOT new.lending_date AND old.lending_date IS NOT NULL BEGIN {remove} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS lending_counts_update_new AFTER UPDATE OF lending_date ON lendings
+            WHEN old.lending_date IS NOT new.lending_date AND new.lending_date IS NOT NULL BEGIN {add} END""",
+        #weeks start on monday, months on the 1st
+        """CREATE VIEW IF NOT EXISTS lending_weekly_counts AS
+           SELECT date(lending_date, '-6 days', 'weekday 1') AS week_start, SUM(lendings) AS lendings
+           FROM lending_daily_counts GROUP BY week_start""",
+        """CREATE VIEW IF NOT EXISTS lending_monthly_counts AS
+           SELECT substr(lending_date, 1, 7) || '-01' AS month_start, SUM(lendings) AS lendings
+           FROM lending_daily_counts GROUP BY month_start""",
+    ] + ROLLUP_REBUILD_STATEMENTS
+
+def rebuild_lending_rollup(db):
+    """Recount lending_daily_counts from lendings in one transaction. Returns the number of days, None on failure."""
+    db.transaction()
+    query = QSqlQuery(db)
+    statements = ROLLUP_REBUILD_STATEMENTS
+    if archive_attached(db):
+        statements = statements + [rollup_add_statement("lendings_archive.lendings", "1")]
+    for statement in statements:
+        if not query.exec(statement):
+            print("Rebuilding the lending counts failed:", query.lastError().text())
+            db.rollback()
+            return None
+    db.commit()
+    query.exec("SELECT COUNT(*) FROM lending_daily_counts")
+    return query.value(0) if query.next() else 0
+
+def rollup_add_statement(source, condition):
+    """Statement adding the lendings of source matching condition to the daily counts."""
+    return f"""INSERT INTO lending_daily_counts (lending_date, lendings)
+               SELECT lending_date, COUNT(*) FROM {source} WHERE {condition} AND lending_date IS NOT NULL GROUP BY lending_date
+               ON CONFLICT(lending_date) DO UPDATE SET lendings = lendings + excluded.lendings"""
+
+#closed lendings can be moved to an archive db next to the lending db (car_lending.db -> car_lending_archive.db),
+#attached to every connection as lendings_archive; ids stay unique across both, lendings ids are AUTOINCREMENT
+ARCHIVE_STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS lendings_archive.lendings (
+           id INTEGER PRIMARY KEY,
+           customer_id INTEGER,
+           car_id INTEGER,
+           lending_date TEXT,
+           return_date TEXT
+       )""",
+    "CREATE INDEX IF NOT EXISTS lendings_archive.idx_archive_car_return_date ON lendings(car_id, return_date)",
+    "CREATE INDEX IF NOT EXISTS lendings_archive.idx_archive_return_date ON lendings(return_date)",
+    "CREATE INDEX IF NOT EXISTS lendings_archive.idx_archive_lending_date ON lendings(lending_date)",
+    "CREATE INDEX IF NOT EXISTS lendings_archive.idx_archive_customer_id ON lendings(customer_id)",
+]
+#lendings with a valid return date before the cutoff, walking idx_lendings_return_date
+ARCHIVABLE_CONDITION = "return_date < ? AND julianday(return_date) IS NOT NULL"
+#one batch, moved in one transaction
+ARCHIVE_BATCH_STATEMENTS = [
+    "INSERT OR REPLACE INTO lendings_archive.lendings SELECT * FROM main.lendings WHERE id IN temp.archive_batch",
+    #the delete triggers take the lendings off the daily counts, which keep counting archived lendings
+    rollup_add_statement("main.lendings", "id IN temp.archive_batch"),
+    "DELETE FROM main.lendings WHERE id IN temp.archive_batch",
+    "DELETE FROM temp.archive_batch",
+]
+
+def archive_path(db):
+    return os.path.splitext(os.path.abspath(db.databaseName()))[0] + "_archive.db"
+
+def archive_attached(db):
+    return QSqlQuery("SELECT 1 FROM pragma_database_list WHERE name = 'lendings_archive'", db).next()
+
+def attach_archive(db, create=False):
+    """Attach the archive db if it exists (or create it) and set up the all_lendings view. Returns whether it is attached.
+
+    all_lendings is every lending, archived ones included, for reports; it has to be a TEMP
+    view since views stored in the lending db can't refer to attached databases.
+    ATTACH doesn't work inside a transaction.
+    """
+    query = QSqlQuery(db)
+    attached = archive_attached(db)
+    path = archive_path(db)
+    if not attached and (create or os.path.exists(path)):
+        query.prepare("ATTACH DATABASE ? AS lendings_archive")
+        query.addBindValue(path)
+        if not query.exec():
+            print("Unable to attach the lending archive:", query.lastError().text())
+        else:
+            attached = all(query.exec(statement) for statement in ARCHIVE_STATEMENTS)
+            if not attached:
+                print("Unable to create the lending archive:", query.lastError().text())
+                query.exec("DETACH DATABASE lendings_archive")
+    view = "SELECT *, 0 AS archived FROM main.lendings"
+    if attached:
+        view += " UNION ALL SELECT *, 1 AS archived FROM lendings_archive.lendings"
+    query.exec("DROP VIEW IF EXISTS temp.all_lendings")
+    query.exec(f"CREATE TEMP VIEW all_lendings AS {view}")
+    return attached
+
+def archive_lendings(db, before, dry_run=False, batch_size=5000, report=print):
+    """Move the lendings returned before a date (ISO) to the archive db. Returns how many, None on failure.
+
+    Each batch_size lendings are one transaction. The graph counts keep the archived lendings,
+    the table views, the availability index and the delete rules no longer see them (the
+    availability checks look them up in the archive). In WAL mode a transaction is not atomic
+    across the two files: after a crash a batch may be in both, the next run moves it again.
+    """
+    query = QSqlQuery(db)
+    query.prepare(f"SELECT COUNT(*) FROM lendings WHERE {ARCHIVABLE_CONDITION}")
+    query.addBindValue(before)
+    total = query.value(0) if query.exec() and query.next() else 0
+    report(f"{total} lendings returned before {before}")
+    if dry_run or not total:
+        return total
+    if not attach_archive(db, create=True):
+        return None
+    query.exec("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+    start = time.perf_counter()
+    moved = 0
+    while moved < total:
+        db.transaction()
+        query.prepare(f"INSERT INTO temp.archive_batch SELECT id FROM main.lendings WHERE {ARCHIVABLE_CONDITION} LIMIT ?")
+        query.addBindValue(before)
+        query.addBindValue(batch_size)
+        ok = query.exec()
+        batch = query.numRowsAffected() if ok else 0
+        ok = ok and all(query.exec(statement) for statement in ARCHIVE_BATCH_STATEMENTS)
+        if not ok:
+            report(f"Archiving failed, the last batch was rolled back: {query.lastError().text()}")
+            db.rollback()
+            return None
+        db.commit()
+        if not batch:
+            break #changed by another connection since counting
+        moved += batch
+        report(f"{moved} of {total} lendings archived ({moved / (time.perf_counter() - start):.0f} rows/s)")
+    METRICS.record("archive.lendings", time.perf_counter() - start, moved)
+    return moved
+
+#availability index: every lending as a box of (days it blocks the car) x (car id) in an R*Tree,
+#days are numbered like date.toordinal(); a car returned on a day is free again from that day
+OPEN_END = 2147483647 #last day of lendings without (valid) return date
+AVAILABILITY_CONFLICTS_SQL = """
+    SELECT lendings.id, lendings.lending_date, lendings.return_date
+    FROM lending_periods JOIN lendings ON lendings.id = lending_periods.id
+    WHERE car_lo <= ? AND car_hi >= ? AND start_day <= ? AND end_day >= ? AND lending_periods.id IS NOT ?
+    ORDER BY start_day LIMIT ?"""
+FREE_CARS_SQL = """
+    SELECT id, make || ' ' || model || ' ' || year FROM cars
+    WHERE id NOT IN ({busy}) {archived}
+    ORDER BY id LIMIT ?"""
+BUSY_CARS_SQL = "SELECT car_lo FROM lending_periods WHERE start_day <= ? AND end_day >= ?"
+#below schema 6 there is no availability index, lendings are then compared by (ISO) dates like archived ones,
+#a lending without a valid return date blocks its car for good
+UNINDEXED_PERIOD_CONDITION = "julianday(lending_date) IS NOT NULL AND lending_date <= ? AND MAX(lending_date, COALESCE(date(return_date, '-1 day'), '9999-12-31')) >= ?"
+UNINDEXED_CONFLICTS_SQL = f"""
+    SELECT id, lending_date, return_date FROM lendings
+    WHERE car_id = ? AND {UNINDEXED_PERIOD_CONDITION} AND id IS NOT ?
+    ORDER BY lending_date LIMIT ?"""
+UNINDEXED_BUSY_CARS_SQL = f"SELECT car_id FROM lendings WHERE car_id IS NOT NULL AND {UNINDEXED_PERIOD_CONDITION}"
+#archived lendings aren't in the index, they are looked up by (ISO) dates; all of them have a valid return date.
+#the + keeps sqlite on the return date indexes, periods after the archived ones then find nothing right away
+ARCHIVED_PERIOD_CONDITION = "return_date >= ? AND +lending_date <= ? AND MAX(lending_date, date(return_date, '-1 day')) >= ?"
+ARCHIVE_CONFLICTS_SQL = f"""
+    SELECT id, lending_date, return_date FROM lendings_archive.lendings
+    WHERE car_id = ? AND {ARCHIVED_PERIOD_CONDITION} AND id IS NOT ?
+    ORDER BY lending_date LIMIT ?"""
+ARCHIVE_BUSY_CARS_SQL = f"AND id NOT IN (SELECT car_id FROM lendings_archive.lendings WHERE {ARCHIVED_PERIOD_CONDITION})"
+
+def period_columns(row):
+    """SELECT list turning a lendings row (alias or new/old) into an availability index entry."""
+    start = f"CAST(julianday({row}.lending_date) - 1721424.5 AS INTEGER)"
+    returned = f"CAST(julianday({row}.return_date) - 1721424.5 AS INTEGER)"
+    return f"{row}.id, {start}, MAX({start}, COALESCE({returned} - 1, {OPEN_END})), {row}.car_id, {row}.car_id"
+
+def period_condition(row):
+    return f"julianday({row}.lending_date) IS NOT NULL AND {row}.car_id IS NOT NULL"
+
+def availability_statements():
+    """Statements creating the lending_periods R*Tree, filling it and keeping it in sync with lendings."""
+    insert = f"INSERT INTO lending_periods (id, start_day, end_day, car_lo, car_hi) SELECT {period_columns('new')} WHERE {period_condition('new')};"
+    delete = "DELETE FROM lending_periods WHERE id = old.id;"
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS lending_periods USING rtree_i32(id, start_day, end_day, car_lo, car_hi)",
+        f"CREATE TRIGGER IF NOT EXISTS lending_periods_insert AFTER INSERT ON lendings BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS lending_periods_delete AFTER DELETE ON lendings BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS lending_periods_update AFTER UPDATE OF car_id, lending_date, return_date ON lendings BEGIN {delete} {insert} END",
+        "DELETE FROM lending_periods",
+        f"INSERT INTO lending_periods (id, start_day, end_day, car_lo, car_hi) SELECT {period_columns('lendings')} FROM lendings WHERE {period_condition('lendings')}",
+    ]
+
+def lending_period(lending_date, return_date):
+    """(first, last) day number a lending blocks its car, as stored in lending_periods."""
+    start = datetime.date.fromisoformat(lending_date).toordinal()
+    try:
+        end = datetime.date.fromisoformat(return_date).toordinal() - 1
+    except (TypeError, ValueError):
+        end = OPEN_END
+    return start, max(start, end)
+
+def period_dates(start, end):
+    """(first, last) ISO date of a period of day numbers."""
+    first = datetime.date.fromordinal(start).isoformat()
+    last = datetime.date.fromordinal(min(end, datetime.date.max.toordinal())).isoformat()
+    return first, last
+
+def archived_period_values(start, end):
+    """Values of ARCHIVED_PERIOD_CONDITION for a period of day numbers."""
+    first, last = period_dates(start, end)
+    return [first, last, first]
+
+def conflicting_lendings(db, car_id, lending_date, return_date, exclude_id=None, limit=5):
+    """Lendings of the car overlapping the period, as (id, lending_date, return_date), ignoring exclude_id."""
+    start, end = lending_period(lending_date, return_date)
+    query = QSqlQuery(db)
+    if table_exists(db, "lending_periods"):
+        query.prepare(AVAILABILITY_CONFLICTS_SQL)
+        values = [car_id, car_id, end, start, exclude_id, limit]
+    else:
+        first, last = period_dates(start, end)
+        query.prepare(UNINDEXED_CONFLICTS_SQL)
+        values = [car_id, last, first, exclude_id, limit]
+    for value in values:
+        query.addBindValue(value)
+    with METRICS.timer("query.availability") as sample:
+        if not query.exec():
+            print("Availability check failed:", query.lastError().text())
+            return []
+        conflicts = []
+        while query.next():
+            conflicts.append((query.value(0), query.value(1), query.value(2)))
+        if archive_attached(db):
+            query.prepare(ARCHIVE_CONFLICTS_SQL)
+            for value in [car_id] + archived_period_values(start, end) + [exclude_id, limit]:
+                query.addBindValue(value)
+            if not query.exec():
+                print("Archive availability check failed:", query.lastError().text())
+            while query.next():
+                conflicts.append((query.value(0), query.value(1), query.value(2)))
+            conflicts = sorted(conflicts, key=lambda conflict: conflict[1])[:limit]
+        sample["rows"] = len(conflicts)
+    return conflicts
+
+def availability_message(car_id, conflicts):
+    periods = "\n".join(f"lending #{conflict_id}: {lent} to {returned or 'not returned'}" for conflict_id, lent, returned in conflicts)
+    return f"Car #{car_id} is already lent in this period:\n{periods}"
+
+#plain text for the constraint errors users run into when saving, by a part of the driver's error text
+WRITE_ERRORS = {
+    "UNIQUE constraint failed: customers.email": "A customer with this email already exists.",
+    "FOREIGN KEY constraint failed": "The selected customer or car no longer exists.",
+}
+
+def write_error_message(error):
+    """Message for a failed insert or update, the error text itself if it isn't a known constraint error."""
+    for part, message in WRITE_ERRORS.items():
+        if part in error:
+            return message
+    return error
+
+#lending fields an edit has to re-check availability for
+AVAILABILITY_FIELDS = ("car_id", "lending_date", "return_date")
+
+def batch_conflict_message(db, record_ids):
+    """Error text for the first of the lendings that overlaps another one, None if none does.
+
+    Meant to run after the lendings were written, before committing: the availability
+    index is then already updated, so the lendings are checked against each other too.
+    """
+    query = QSqlQuery(db)
+    query.prepare("SELECT car_id, lending_date, return_date FROM lendings WHERE id = ?")
+    for record_id in record_ids:
+        query.addBindValue(record_id)
+        if not query.exec() or not query.next():
+            continue
+        try:
+            conflicts = conflicting_lendings(db, query.value(0), query.value(1), query.value(2), record_id, limit=1)
+        except (TypeError, ValueError):
+            #no (ISO) lending date: the lending isn't in the availability index and blocks no days
+            continue
+        if conflicts:
+            return f"Lending #{record_id} would overlap lending #{conflicts[0][0]} of the same car, nothing was changed."
+    return None
+
+def free_cars(db, from_date, to_date, limit=500):
+    """Cars without any lending overlapping the period, as (id, label), at most limit of them."""
+    start, end = lending_period(from_date, to_date)
+    query = QSqlQuery(db)
+    if table_exists(db, "lending_periods"):
+        busy, values = BUSY_CARS_SQL, [end, start]
+    else:
+        first, last = period_dates(start, end)
+        busy, values = UNINDEXED_BUSY_CARS_SQL, [last, first]
+    if archive_attached(db):
+        query.prepare(FREE_CARS_SQL.format(busy=busy, archived=ARCHIVE_BUSY_CARS_SQL))
+        values += archived_period_values(start, end) + [limit]
+    else:
+        query.prepare(FREE_CARS_SQL.format(busy=busy, archived=""))
+        values += [limit]
+    for value in values:
+        query.addBindValue(value)
+    with METRICS.timer("query.free_cars") as sample:
+        if not query.exec():
+            print("Free cars query failed:", query.lastError().text())
+            return []
+        cars = []
+        while query.next():
+            cars.append((query.value(0), query.value(1)))
+        sample["rows"] = len(cars)
+    return cars
+
+#foreign keys (child table.column) and the table they reference; what deleting a referenced row
+#does is stored per relationship in delete_rules: "restrict" refuses, "cascade" deletes the children
+RELATIONSHIPS = {
+    "lendings.customer_id": "customers",
+    "lendings.car_id": "cars",
+}
+DELETE_RULES = ["restrict", "cascade"]
+
+def delete_rule_statements():
+    """Statements creating the delete_rules table and the triggers applying it before a parent row is deleted."""
+    statements = [
+        """CREATE TABLE IF NOT EXISTS delete_rules (
+               relationship TEXT PRIMARY KEY,
+               rule TEXT NOT NULL CHECK (rule IN ('restrict', 'cascade'))
+           )""",
+    ]
+    for relationship, parent in RELATIONSHIPS.items():
+        child, column = relationship.split(".")
+        rule = f"(SELECT rule FROM delete_rules WHERE relationship = '{relationship}')"
+        statements += [
+            f"INSERT OR IGNORE INTO delete_rules (relationship, rule) VALUES ('{relationship}', 'restrict')",
+            #both statements use the index on the foreign key column
+            f"""CREATE TRIGGER IF NOT EXISTS {parent}_delete_{child}_{column} BEFORE DELETE ON {parent} BEGIN
+                    SELECT RAISE(ABORT, '{parent} row still referenced by {relationship}')
+                    WHERE {rule} = 'restrict' AND EXISTS (SELECT 1 FROM {child} WHERE {column} = old.id);
+                    DELETE FROM {child} WHERE {column} = old.id AND {rule} = 'cascade';
+                END""",
+        ]
+    return statements
+
+def delete_rule(db, relationship):
+    query = QSqlQuery(db)
+    query.prepare("SELECT rule FROM delete_rules WHERE relationship = ?")
+    query.addBindValue(relationship)
+    return query.value(0) if query.exec() and query.next() else "restrict"
+
+def set_delete_rule(db, relationship, rule):
+    query = QSqlQuery(db)
+    query.prepare("INSERT OR REPLACE INTO delete_rules (relationship, rule) VALUES (?, ?)")
+    query.addBindValue(relationship)
+    query.addBindValue(rule)
+    if not query.exec():
+        print(f"Failed to set the delete rule of {relationship}:", query.lastError().text())
+        return False
+    return True
+
+def find_orphans(db):
+    """Ids of lendings whose customer or car doesn't exist, from PRAGMA foreign_key_check."""
+    query = QSqlQuery("PRAGMA foreign_key_check(lendings)", db)
+    ids = set()
+    while query.next():
+        ids.add(query.value(1))
+    return sorted(ids)
+
+def repair_orphans(db, dry_run=False, chunk_size=5000, report=print):
+    """Delete orphaned lendings in batches inside one transaction. Returns how many were found, None on failure."""
+    ids = find_orphans(db)
+    report(f"{len(ids)} orphaned lendings found")
+    if dry_run or not ids:
+        return len(ids)
+    db.transaction()
+    query = QSqlQuery(db)
+    query.prepare("DELETE FROM lendings WHERE id = ?")
+    for start in range(0, len(ids), chunk_size):
+        query.addBindValue(ids[start:start + chunk_size])
+        if not query.execBatch():
+            report(f"Repair failed: {query.lastError().text()}")
+            db.rollback()
+            return None
+        report(f"{min(start + chunk_size, len(ids))} of {len(ids)} orphaned lendings deleted")
+    db.commit()
+    return len(ids)
+
+#columns of the full-text search indexes, kept in sync with their table by triggers
+SEARCH_COLUMNS = {
+    "customers": ["name", "email"],
+    "cars": ["make", "model"],
+}
+
+def fts_statements(table, columns):
+    """Statements creating an external-content FTS5 index over a table, with its triggers."""
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    insert = f"INSERT INTO {table}_fts(rowid, {names}) VALUES (new.id, {new_values});"
+    delete = f"INSERT INTO {table}_fts({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5({names}, content='{table}', content_rowid='id', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')",
+    ]
+
+def table_exists(db, name):
+    """Whether the main db has a table or view of that name, i.e. whether its migration ran."""
+    query = QSqlQuery(db)
+    query.prepare("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?")
+    query.addBindValue(name)
+    return query.exec() and query.next()
+
+def search_condition(db, table, text):
+    """Filter condition matching rows whose indexed columns contain words starting with each typed word.
+
+    Below schema 4 there is no full-text index yet and each word is matched with a LIKE scan instead.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return "", []
+    if not table_exists(db, f"{table}_fts"):
+        columns = SEARCH_COLUMNS[table]
+        conditions = " AND ".join("(" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in columns) + ")" for _ in words)
+        patterns = ["%" + word.replace("_", "\\_") + "%" for word in words] #_ is a LIKE wildcard
+        return conditions, [pattern for pattern in patterns for _ in columns]
+    match = " ".join(f'"{word}"*' for word in words)
+    return f"id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?)", [match]
+
+#schema migrations, applied in order; PRAGMA user_version holds how many already ran
+SCHEMA_MIGRATIONS = [
+    #1: indexes for the graph aggregation and per-customer/per-car lookups
+    [
+        "CREATE INDEX IF NOT EXISTS idx_lendings_lending_date ON lendings(lending_date)",
+        "CREATE INDEX IF NOT EXISTS idx_lendings_customer_id ON lendings(customer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_lendings_car_id ON lendings(car_id)",
+        "CREATE INDEX IF NOT EXISTS idx_lendings_return_date ON lendings(return_date)",
+    ],
+    #2: unique email lookup, kept separate since it fails on databases with duplicate emails
+    [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_email ON customers(email)",
+    ],
+    #3: converting dates written by older versions (dd.MM.yyyy) to ISO yyyy-MM-dd
+    [
+        """UPDATE lendings SET lending_date = substr(lending_date, 7, 4) || '-' || substr(lending_date, 4, 2) || '-' || substr(lending_date, 1, 2)
+           WHERE lending_date GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'""",
+        """UPDATE lendings SET return_date = substr(return_date, 7, 4) || '-' || substr(return_date, 4, 2) || '-' || substr(return_date, 1, 2)
+           WHERE return_date GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'""",
+    ],
+    #4: full-text search over customer names/emails and car makes/models
+    fts_statements("customers", SEARCH_COLUMNS["customers"]) + fts_statements("cars", SEARCH_COLUMNS["cars"]),
+    #5: per-day lending counts for the graph, maintained by triggers
+    rollup_statements(),
+    #6: availability index over lending periods, maintained by triggers
+    availability_statements(),
+    #7: restrict/cascade rules for deleting customers and cars that still have lendings
+    delete_rule_statements(),
+    #8: indexes for sorting the table views by any column (lendings columns and email are indexed already)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name)",
+        "CREATE INDEX IF NOT EXISTS idx_cars_make ON cars(make)",
+        "CREATE INDEX IF NOT EXISTS idx_cars_model ON cars(model)",
+        "CREATE INDEX IF NOT EXISTS idx_cars_year ON cars(year)",
+    ],
+]
+
+#queries the app runs all the time, none of them should need a full table scan
+HOT_QUERIES = {
+    "graph aggregation": LENDING_COUNTS_SQL,
+    "table page": "SELECT * FROM lendings WHERE id > ? ORDER BY id LIMIT ?",
+    "sorted table page": "SELECT * FROM customers WHERE (name, id) > (?, ?) ORDER BY name, id LIMIT ?",
+    "sorted table page, descending": "SELECT * FROM lendings WHERE (lending_date, id) < (?, ?) ORDER BY lending_date DESC, id DESC LIMIT ?",
+    "lending date of a record": "SELECT lending_date FROM lendings WHERE id = ?",
+    "lendings of a customer": "SELECT id FROM lendings WHERE customer_id = ?",
+    "lendings of a car": "SELECT id FROM lendings WHERE car_id = ?",
+    "lendings returned after a date": "SELECT id FROM lendings WHERE return_date >= ?",
+    "lendings in a date range": "SELECT id FROM lendings WHERE lending_date BETWEEN ? AND ?",
+    "customer by email": "SELECT id FROM customers WHERE email = ?",
+    "customer search": "SELECT rowid FROM customers_fts WHERE customers_fts MATCH ?",
+    "car search": "SELECT rowid FROM cars_fts WHERE cars_fts MATCH ?",
+    "lendings of a customer in a date range": "SELECT id FROM lendings WHERE customer_id = ? AND lending_date BETWEEN ? AND ?",
+    "overlapping lendings of a car": AVAILABILITY_CONFLICTS_SQL,
+}
+
+#migrations no later one depends on, with a query listing the rows that make them fail;
+#a failed one is recorded in deferred_migrations and retried on every start instead of
+#holding back the rest of the schema
+OPTIONAL_MIGRATIONS = {
+    2: "SELECT email, COUNT(*) FROM customers GROUP BY email HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC LIMIT 10",
+}
+
+def deferred_migrations(db):
+    query = QSqlQuery("SELECT number FROM deferred_migrations ORDER BY number", db)
+    numbers = []
+    while query.next():
+        numbers.append(query.value(0))
+    return numbers
+
+def run_statements(query, statements):
+    """Run statements in order. Returns the error text of the first failing one, None if all ran."""
+    for statement in statements:
+        if not query.exec(statement):
+            return query.lastError().text()
+    return None
+
+def report_migration_failure(db, number, error):
+    if number not in OPTIONAL_MIGRATIONS:
+        print(f"Schema migration {number} failed:", error)
+        return
+    print(f"Schema migration {number} skipped, it is retried on the next start:", error)
+    query = QSqlQuery(OPTIONAL_MIGRATIONS[number], db)
+    while query.next():
+        print(f"  {query.value(0)!r}: {query.value(1)} rows")
+
+def migrate_db(db):
+    """Run the pending and deferred schema migrations, each in its own transaction. Returns the schema version."""
+    query = QSqlQuery("PRAGMA user_version", db)
+    version = query.value(0) if query.next() else 0
+    deferred = deferred_migrations(db)
+    for number in deferred + list(range(version + 1, len(SCHEMA_MIGRATIONS) + 1)):
+        db.transaction()
+        query = QSqlQuery(db)
+        error = run_statements(query, SCHEMA_MIGRATIONS[number - 1])
+        if error is not None:
+            db.rollback()
+            report_migration_failure(db, number, error)
+            if number not in OPTIONAL_MIGRATIONS:
+                return version
+            if number in deferred:
+                continue
+            db.transaction()
+            query.exec("CREATE TABLE IF NOT EXISTS deferred_migrations (number INTEGER PRIMARY KEY)")
+            query.exec(f"INSERT INTO deferred_migrations (number) VALUES ({number})")
+        elif number in deferred:
+            query.exec(f"DELETE FROM deferred_migrations WHERE number = {number}")
+        if number > version:
+            query.exec(f"PRAGMA user_version = {number}")
+            version = number
+        db.commit()
+    return version
+
+def check_query_plans(db):
+    """Warn about hot queries that fall back to a full table scan. Returns their names."""
+    slow = []
+    for name, sql in HOT_QUERIES.items():
+        query = QSqlQuery(db)
+        query.prepare("EXPLAIN QUERY PLAN " + sql)
+        for _ in range(sql.count("?")):
+            query.addBindValue(None)
+        if not query.exec():
+            print(f"Unable to check query plan of {name}:", query.lastError().text())
+            continue
+        while query.next():
+            detail = query.value(3)
+            #"SCAN x USING (COVERING) INDEX" reads an index, a bare "SCAN x" reads the whole table
+            if detail.startswith("SCAN") and "INDEX" not in detail and "CONSTANT ROW" not in detail and detail.split()[1] not in ROLLUP_TABLES:
+                print(f"Warning: {name} does a full scan ({detail}): {sql}")
+                slow.append(name)
+                break
+    return slow
+
+#per-date counts from the rollup (or the lendings below schema 5), only needed at startup and after writes from other processes
+def query_lending_counts(db):
+    with METRICS.timer("query.lending_counts") as sample:
+        query = QSqlQuery(LENDING_COUNTS_SQL if table_exists(db, "lending_daily_counts") else UNROLLED_LENDING_COUNTS_SQL, db)
+        counts = {}
+        while query.next():
+            counts[query.value(0)] = query.value(1)
+        sample["rows"] = len(counts)
+    return counts
+
+def series_from_counts(counts):
+    dates = sorted(counts)
+    return dates, [counts[date] for date in dates]
+
+#chart buckets, "Auto" picks the finest one that fits the canvas
+GRAPH_BUCKETS = ["Auto", "Day", "Week", "Month"]
+BUCKET_LABELS = {"Day": "Date", "Week": "Week (starting Monday)", "Month": "Month"}
+MIN_BAR_WIDTH = 8 #pixels per bar or wedge when picking the bucket automatically
+MIN_POINT_SPACING = 2 #pixels per line graph point
+
+def bucket_start(date, bucket):
+    """First day of the week (monday) or month an ISO date falls in, unparsable dates are kept as they are."""
+    if bucket == "Day":
+        return date
+    try:
+        day = datetime.date.fromisoformat(date)
+    except (TypeError, ValueError):
+        return date
+    if bucket == "Week":
+        day -= datetime.timedelta(days=day.weekday())
+    else:
+        day = day.replace(day=1)
+    return day.isoformat()
+
+def bucket_counts(counts, bucket):
+    if bucket == "Day":
+        return counts
+    buckets = {}
+    for date, count in counts.items():
+        start = bucket_start(date, bucket)
+        buckets[start] = buckets.get(start, 0) + count
+    return buckets
+
+def choose_bucket(counts, slots):
+    """The finest bucket giving at most slots buckets, months when none does."""
+    if len(counts) <= slots:
+        return "Day"
+    if len(bucket_counts(counts, "Week")) <= slots:
+        return "Week"
+    return "Month"
+
+def top_with_other(dates, counts, n):
+    """The n largest slices, largest first, plus an "Other" slice summing the rest."""
+    if n <= 0 or len(dates) <= n + 1:
+        return dates, counts
+    ranked = sorted(zip(counts, dates), key=lambda pair: pair[0], reverse=True)
+    other = sum(count for count, _ in ranked[n:])
+    return [date for _, date in ranked[:n]] + ["Other"], [count for count, _ in ranked[:n]] + [other]
+
+def lttb_indices(xs, ys, threshold):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets down-sampling to threshold points.
+
+    The first and last points are always kept; from every bucket in between the
+    point forming the largest triangle with the previously kept point and the
+    average of the next bucket is kept, which preserves peaks and dips.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    previous = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[end:next_end]) / (next_end - end)
+        avg_y = sum(ys[end:next_end]) / (next_end - end)
+        px, py = xs[previous], ys[previous]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((px - avg_x) * (ys[j] - py) - (px - xs[j]) * (avg_y - py))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        previous = best
+    kept.append(n - 1)
+    return kept
+
+def chart_series(counts, graph_type, bucket, width, top):
+    """The (bucket, dates, counts) to plot for a canvas width pixels wide.
+
+    Dates are grouped into the bucket (chosen from the width for "Auto"), pie
+    charts keep the top slices plus "Other", and line graphs are down-sampled
+    to at most one point per MIN_POINT_SPACING pixels.
+    """
+    point_spacing = MIN_POINT_SPACING if graph_type == "Line Graph" else MIN_BAR_WIDTH
+    slots = max(width // point_spacing, 3)
+    if bucket not in BUCKET_LABELS:
+        bucket = choose_bucket(counts, slots)
+    dates, values = series_from_counts(bucket_counts(counts, bucket))
+    if graph_type == "Pie Chart":
+        dates, values = top_with_other(dates, values, top)
+    elif graph_type == "Line Graph" and len(dates) > slots:
+        try:
+            xs = [datetime.date.fromisoformat(date).toordinal() for date in dates]
+        except (TypeError, ValueError):
+            xs = list(range(len(dates)))
+        kept = lttb_indices(xs, values, slots)
+        dates, values = [dates[i] for i in kept], [values[i] for i in kept]
+    return bucket, dates, values
+
+#lending snapshot columns as read: customer and car ids (0 where missing), lending and return day as
+#day numbers (date.toordinal(), like lending_periods; -1 where missing or not a valid date)
+SNAPSHOT_COLUMNS = ["customer_id", "car_id", "lending_day", "return_day"]
+#a chunk of lendings after an id as one row of comma separated columns, much faster than reading them row by row
+SNAPSHOT_CHUNK_SQL = """
+    SELECT COUNT(*), MAX(id), group_concat(COALESCE(customer_id, 0)), group_concat(COALESCE(car_id, 0)),
+           group_concat(COALESCE(CAST(julianday(lending_date) - 1721424.5 AS INTEGER), -1)),
+           group_concat(COALESCE(CAST(julianday(return_date) - 1721424.5 AS INTEGER), -1))
+    FROM (SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?)"""
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+class LendingSnapshot:
+    """The lendings (archived ones included) held in memory as numpy columns, backing the analytics.
+
+    Rows are kept ordered by lending day, so the lendings starting in a period are a slice,
+    and per car/customer totals are kept next to the columns: an analytics pass only reads
+    the rows inside the period or the rows outside it, whichever are fewer.
+    refresh() only reads the lendings past the highest id already held; edits and deletes
+    can't be caught that way, so after those invalidate() makes the next refresh read
+    everything again.
+    """
+    CHUNK = 100000 #lendings per query
 
-class CarLendingApp(QWidget):
     def __init__(self):
+        try:
+            import numpy
+        except ImportError:
+            numpy = None #matplotlib needs it as well, refresh() refuses to run without it
+        self.numpy = numpy
+        self.generation = 0 #bumped by invalidate(), a refresh running meanwhile drops what it read
+        self.invalidate()
+
+    def invalidate(self):
+        self.generation += 1
+        self.watermark = 0 #highest lending id read
+        self.size = 0
+        self.max_span = 0 #most days a returned lending blocked its car
+        if self.numpy is not None:
+            np = self.numpy
+            empty = np.zeros(0, dtype=np.int32)
+            #end_day is the first day the car is free again (OPEN_END if not returned), span the days
+            #a returned lending blocked it (0 if not returned), duration the days until it was returned
+            self.columns = {name: empty for name in ["customer_id", "car_id", "lending_day", "end_day", "span", "duration"]}
+            self.open_rows = empty #rows of the lendings not returned
+            self.car_span_totals = np.zeros(1) #per car id, the span column summed
+            self.customer_totals = np.zeros(1, dtype=np.int64) #per customer id, lendings
+            self.returned_before = np.zeros(1, dtype=np.int64) #per row, returned lendings in the rows before it
+            self.duration_before = np.zeros(1, dtype=np.int64) #per row, their durations summed
+
+    def refresh(self, db, report=print):
+        """Read the lendings added since the last refresh (all of them after invalidate()). Returns how many were read."""
+        if self.numpy is None:
+            raise RuntimeError("The lending analytics need numpy, which is not installed")
+        np = self.numpy
+        tables = ["main.lendings"]
+        if not self.watermark and archive_attached(db):
+            tables.append("lendings_archive.lendings") #new lendings are never archived right away
+        parts = {name: [] for name in SNAPSHOT_COLUMNS}
+        read = 0
+        highest = self.watermark
+        generation = self.generation
+        with METRICS.timer("snapshot.refresh") as sample:
+            for table in tables:
+                query = QSqlQuery(db)
+                query.prepare(SNAPSHOT_CHUNK_SQL.format(table=table))
+                after = self.watermark
+                while True:
+                    query.addBindValue(after)
+                    query.addBindValue(self.CHUNK)
+                    if not query.exec() or not query.next():
+                        raise RuntimeError(f"Reading the lendings failed: {query.lastError().text()}")
+                    if not query.value(0):
+                        break
+                    after = query.value(1)
+                    for i, name in enumerate(SNAPSHOT_COLUMNS):
+                        parts[name].append(np.fromstring(query.value(i + 2), dtype=np.int32, sep=","))
+                    read += query.value(0)
+                    report(f"{self.size + read} lendings read")
+                highest = max(highest, after)
+            #the snapshot only changes once everything was read
+            if generation != self.generation:
+                return 0
+            if read:
+                self.add_rows(*(np.concatenate(parts[name]) for name in SNAPSHOT_COLUMNS))
+            self.watermark = highest
+            sample["rows"] = read
+        return read
+
+    def add_rows(self, customer, car, lent, returned):
+        np = self.numpy
+        valid = lent >= 0 #lendings without a valid lending date count nowhere
+        customer, car, lent, returned = customer[valid], car[valid], lent[valid], returned[valid]
+        #as in lending_periods: the car is blocked from the lending day to the day before the return, at least one day
+        end = np.where(returned >= 0, np.maximum(returned, lent + 1), OPEN_END).astype(np.int32)
+        span = np.where(returned >= 0, end - lent, 0).astype(np.int32)
+        rows = {
+            "customer_id": customer,
+            "car_id": car,
+            "lending_day": lent,
+            "end_day": end,
+            "span": span,
+            "duration": np.where(returned >= lent, returned - lent, -1).astype(np.int32),
+        }
+        if len(lent):
+            self.max_span = max(self.max_span, int(span.max()))
+            self.car_span_totals = self.add_totals(self.car_span_totals, np.bincount(car, weights=span))
+            self.customer_totals = self.add_totals(self.customer_totals, np.bincount(customer))
+        #new lendings mostly start after the ones held and can be appended, otherwise everything is reordered
+        order = np.argsort(lent, kind="stable")
+        rows = {name: values[order] for name, values in rows.items()}
+        held = self.size
+        ordered = not held or not len(lent) or rows["lending_day"][0] >= self.columns["lending_day"][-1]
+        for name, values in rows.items():
+            self.columns[name] = np.concatenate([self.columns[name], values])
+        if not ordered:
+            order = np.argsort(self.columns["lending_day"], kind="stable")
+            self.columns = {name: values[order] for name, values in self.columns.items()}
+            held = 0
+            rows = self.columns
+            self.open_rows = self.open_rows[:0]
+            self.returned_before = self.returned_before[:1]
+            self.duration_before = self.duration_before[:1]
+        #the per-row indexes only need extending past the rows held before
+        self.size = len(self.columns["lending_day"])
+        self.open_rows = np.concatenate([self.open_rows, held + np.flatnonzero(rows["end_day"] == OPEN_END)])
+        self.returned_before = np.concatenate([self.returned_before, self.returned_before[-1] + np.cumsum(rows["duration"] >= 0, dtype=np.int64)])
+        self.duration_before = np.concatenate([self.duration_before, self.duration_before[-1] + np.cumsum(np.maximum(rows["duration"], 0), dtype=np.int64)])
+
+    def add_totals(self, totals, more):
+        if len(more) > len(totals):
+            totals, more = more, totals
+        totals = totals.copy()
+        totals[:len(more)] += more
+        return totals
+
+    def grouped_sum(self, ids, weights, first_row, last_row, totals):
+        """Per id sums of weights (row counts without weights) over rows first_row:last_row.
+
+        Read from those rows, or as the totals minus the other rows when they are fewer.
+        """
+        np = self.numpy
+
+        def summed(rows):
+            return np.bincount(ids[rows], weights=None if weights is None else weights[rows], minlength=len(totals))
+
+        if 2 * (last_row - first_row) <= self.size:
+            return summed(slice(first_row, last_row))
+        return totals - summed(slice(0, first_row)) - summed(slice(last_row, self.size))
+
+    def band_days(self, rows, first_day, after_last):
+        """Per car days within the period blocked by the returned lendings among rows."""
+        columns = self.columns
+        lent = columns["lending_day"][rows]
+        days = self.numpy.minimum(columns["end_day"][rows], after_last) - self.numpy.maximum(lent, first_day)
+        days[(days < 0) | (columns["span"][rows] == 0)] = 0
+        return self.numpy.bincount(columns["car_id"][rows], weights=days, minlength=len(self.car_span_totals))
+
+    def largest(self, values, top):
+        """Indexes of the top largest positive values, largest first, without sorting all of them."""
+        np = self.numpy
+        candidates = np.argpartition(-values, top)[:top] if len(values) > top else np.arange(len(values))
+        candidates = candidates[np.lexsort((candidates, -values[candidates]))]
+        return [int(index) for index in candidates if values[index] > 0]
+
+    def analytics(self, first_day, last_day, top=10, car_count=None):
+        """Car utilization, rental duration, weekdays and customer frequency over a period of day numbers.
+
+        Utilization is the share of the period's days a car was lent, counting the days the
+        availability index blocks (lendings not returned yet count to the end of the period);
+        the other figures are over the lendings starting in the period. Returns a dict.
+        """
+        np = self.numpy
+        columns = self.columns
+        lent = columns["lending_day"]
+        after_last = last_day + 1
+        with METRICS.timer("snapshot.analytics") as sample:
+            #row ranges by lending day: returned lendings starting before reach end before the period,
+            #the ones starting from first to inside end in it; each band is a slice of the rows
+            #(needles of the column's dtype, others make numpy convert the whole column first)
+            bounds = np.array([first_day - self.max_span, first_day, max(first_day, after_last - self.max_span), after_last], dtype=lent.dtype)
+            reach, first, inside, stop = (int(row) for row in np.searchsorted(lent, bounds))
+            car_days = np.zeros(len(self.car_span_totals)) #bincount answers ints for no rows, floats otherwise
+            car_days += self.band_days(slice(reach, first), first_day, after_last)
+            car_days += self.band_days(slice(inside, stop), first_day, after_last)
+            car_days += self.grouped_sum(columns["car_id"], columns["span"], first, inside, self.car_span_totals)
+            open_rows = self.open_rows[lent[self.open_rows] < after_last]
+            car_days += np.bincount(columns["car_id"][open_rows], weights=after_last - np.maximum(lent[open_rows], first_day), minlength=len(car_days))
+            car_days[0] = 0 #lendings without a car
+            busiest = self.largest(car_days, top)
+
+            customers = self.grouped_sum(columns["customer_id"], None, first, stop, self.customer_totals)
+            customers[0] = 0
+            frequent = self.largest(customers, top)
+
+            #lendings per day of the period, from where each day's rows start; day number 1 is a monday
+            weekdays = [0] * 7
+            if stop > first:
+                days = np.arange(lent[first], lent[stop - 1] + 2, dtype=lent.dtype)
+                per_day = np.diff(np.searchsorted(lent, days))
+                weekdays = np.bincount((days[:-1] - 1) % 7, weights=per_day, minlength=7).astype(np.int64).tolist()
+            returned = int(self.returned_before[stop] - self.returned_before[first])
+            duration_days = int(self.duration_before[stop] - self.duration_before[first])
+            sample["rows"] = self.size
+
+        period = last_day - first_day + 1
+        return {
+            "lendings": int(stop - first),
+            "busiest_cars": [(int(car_id), int(car_days[car_id]), car_days[car_id] / period) for car_id in busiest],
+            "fleet_utilization": car_days.sum() / (period * car_count) if car_count else None,
+            "returned": returned,
+            "mean_duration": duration_days / returned if returned else None,
+            "weekdays": weekdays,
+            "customers": int(np.count_nonzero(customers)),
+            "frequent_customers": [(int(customer_id), int(customers[customer_id])) for customer_id in frequent],
+        }
+
+#columns a file has to provide per table, "id" is optional and kept when present
+IMPORT_COLUMNS = {
+    "customers": ["name", "email"],
+    "cars": ["make", "model", "year"],
+    "lendings": ["customer_id", "car_id", "lending_date", "return_date"],
+}
+INTEGER_COLUMNS = {"id", "year", "customer_id", "car_id"}
+
+FILE_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+def file_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return FILE_FORMATS.get(os.path.splitext(path)[1].lower(), "jsonl")
+
+#streaming a CSV or JSON Lines file one record (dict) at a time
+def read_records(path, fmt=None):
+    fmt = file_format(path, fmt)
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Importing {fmt} files is not supported")
+    with open(path, newline="", encoding="utf-8") as file:
+        if fmt == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+def parse_field_value(column, value):
+    """Convert a field value to what is stored in column, raises ValueError if it is invalid."""
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == "":
+        raise ValueError(f"missing {column}")
+    if column in INTEGER_COLUMNS:
+        return int(value)
+    if column.endswith("_date"):
+        return datetime.date.fromisoformat(value).isoformat()
+    return value
+
+def validate_import_row(table, record, columns, known_ids):
+    """Return the values of a record in column order, raises ValueError if it is invalid."""
+    values = [parse_field_value(column, record.get(column)) for column in columns]
+    if table == "lendings":
+        if values[columns.index("customer_id")] not in known_ids["customers"]:
+            raise ValueError(f"unknown customer_id {values[columns.index('customer_id')]}")
+        if values[columns.index("car_id")] not in known_ids["cars"]:
+            raise ValueError(f"unknown car_id {values[columns.index('car_id')]}")
+    return values
+
+def load_ids(db, table):
+    query = QSqlQuery(db)
+    query.setForwardOnly(True)
+    query.exec(f"SELECT id FROM {table}")
+    ids = set()
+    while query.next():
+        ids.add(query.value(0))
+    return ids
+
+def import_records(db, table, path, fmt=None, chunk_size=5000, commit_every=100000, report=print):
+    """Stream a CSV/JSON Lines file into a table with batched inserts.
+
+    Rows are validated (lending foreign keys against in-memory id sets) and
+    inserted chunk_size at a time with QSqlQuery.execBatch, inside transactions
+    of commit_every rows. Only one chunk is held in memory. Returns a summary dict.
+    """
+    records = read_records(path, fmt)
+    first = next(records, None)
+    columns = (["id"] if first is not None and "id" in first else []) + IMPORT_COLUMNS[table]
+    known_ids = {"customers": load_ids(db, "customers"), "cars": load_ids(db, "cars")} if table == "lendings" else {}
+
+    query = QSqlQuery(db)
+    query.prepare(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})")
+    summary = {"table": table, "imported": 0, "rejected": 0, "errors": [], "failed": None}
+    chunk = [[] for _ in columns]
+    pending = 0 #rows inserted since the last commit
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal pending
+        for values in chunk:
+            query.addBindValue(values)
+        if not query.execBatch():
+            raise RuntimeError(query.lastError().text())
+        pending += len(chunk[0])
+        for values in chunk:
+            values.clear()
+        if pending >= commit_every:
+            db.commit()
+            summary["imported"] += pending
+            pending = 0
+            db.transaction()
+            elapsed = time.perf_counter() - start
+            report(f"{table}: {summary['imported']} rows imported ({summary['imported'] / elapsed:.0f} rows/s)")
+
+    db.transaction()
+    try:
+        for number, record in enumerate(itertools.chain([first] if first is not None else [], records), start=1):
+            try:
+                values = validate_import_row(table, record, columns, known_ids)
+            except (ValueError, TypeError) as error:
+                summary["rejected"] += 1
+                if len(summary["errors"]) < 20:
+                    summary["errors"].append(f"record {number}: {error}")
+                continue
+            for column_values, value in zip(chunk, values):
+                column_values.append(value)
+            if len(chunk[0]) >= chunk_size:
+                flush()
+        if chunk[0]:
+            flush()
+        db.commit()
+        summary["imported"] += pending
+    except RuntimeError as error:
+        db.rollback()
+        summary["failed"] = str(error)
+        report(f"Import into {table} stopped, the last uncommitted batch was rolled back: {error}")
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    METRICS.record(f"import.{table}", time.perf_counter() - start, summary["imported"])
+    summary["rows_per_s"] = round(summary["imported"] / summary["seconds"], 1) if summary["seconds"] else 0.0
+    report(f"{table}: {summary['imported']} rows imported, {summary['rejected']} rejected in {summary['seconds']} s ({summary['rows_per_s']} rows/s)")
+    return summary
+
+GRAPH_TITLES = {
+    "Bar Chart": "Lendings per Date - Bar Chart",
+    "Pie Chart": "Lendings Distribution - Pie Chart",
+    "Line Graph": "Lendings per Date - Line Graph",
+}
+
+def data_version(db):
+    """PRAGMA data_version, which changes whenever another connection commits to the db."""
+    query = QSqlQuery("PRAGMA data_version", db)
+    return query.value(0) if query.next() else None
+
+class LendingGraphTracker:
+    """Keeps per-date lending counts in memory and tracks whether they changed."""
+
+    def __init__(self, db):
+        self.db = db
+        self.counts = {} #lending_date -> number of lendings
+        self.version = 0 #bumped every time the aggregate changes
+        self.drawn_version = -1 #version currently shown on the canvas
+        self.skipped_ticks = 0 #timer ticks that did not need a redraw
+        self.data_version = None #last seen PRAGMA data_version
+
+    def replace(self, counts):
+        if counts != self.counts:
+            self.counts = counts
+            self.version += 1
+
+    #applying a delta for a single lending date
+    def add(self, date, delta):
+        if date is None or delta == 0:
+            return
+        count = self.counts.get(date, 0) + delta
+        if count > 0:
+            self.counts[date] = count
+        else:
+            self.counts.pop(date, None)
+        self.version += 1
+
+    def move(self, old_date, new_date):
+        if old_date != new_date:
+            self.add(old_date, -1)
+            self.add(new_date, 1)
+
+    def external_change(self):
+        """Return True if another connection committed to the db since the last check."""
+        current = data_version(self.db)
+        changed = self.data_version is not None and current != self.data_version
+        self.data_version = current
+        return changed
+
+    def is_dirty(self):
+        return self.version != self.drawn_version
+
+class GraphWorker(QThread):
+    """Computes the lending graph series off the GUI thread, on its own db connection.
+
+    Only the latest request is kept: requests arriving while a job runs replace
+    each other, so a burst of changes costs at most one extra job.
+    """
+    #generation, reloaded counts (None if not reloaded), (bucket, dates, counts)
+    result_ready = pyqtSignal(int, object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.mutex = QMutex()
+        self.condition = QWaitCondition()
+        self.pending = None
+        self.stopping = False
+
+    def request(self, generation, counts, options, reload=False):
+        """options are the chart_series arguments after counts: graph type, bucket, width and top slices."""
+        self.mutex.lock()
+        #a superseded job may still owe a reload, keep that part of it
+        reload = reload or (self.pending is not None and self.pending[2])
+        self.pending = (generation, dict(counts), reload, options)
+        self.condition.wakeOne()
+        self.mutex.unlock()
+
+    def stop(self):
+        self.mutex.lock()
+        self.stopping = True
+        self.condition.wakeOne()
+        self.mutex.unlock()
+        self.wait()
+
+    def run(self):
+        db = open_connection("graph_worker")
+        while True:
+            self.mutex.lock()
+            while self.pending is None and not self.stopping:
+                self.condition.wait(self.mutex)
+            job, self.pending = self.pending, None
+            stopping = self.stopping
+            self.mutex.unlock()
+            if stopping:
+                break
+
+            generation, counts, reload, options = job
+            reloaded = None
+            if reload and db is not None:
+                reloaded = query_lending_counts(db)
+                counts = reloaded
+            with METRICS.timer("graph.series"):
+                series = chart_series(counts, *options)
+            self.result_ready.emit(generation, reloaded, series)
+
+        if db is not None:
+            db.close()
+        del db
+        QSqlDatabase.removeDatabase("graph_worker")
+
+class DatabaseTask(QThread):
+    """Runs a long db job (import, export, ...) on its own connection, off the GUI thread.
+
+    job is called as job(db, report) where report(message) posts a progress message.
+    """
+    progress = pyqtSignal(str)
+    finished_with = pyqtSignal(object) #the job's return value
+
+    def __init__(self, job, profile=None, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self.profile = profile
+
+    def run(self):
+        name = f"db_task_{id(self)}"
+        db = open_connection(name, profile=self.profile)
+        if db is None:
+            result = {"failed": "Unable to open database"}
+        else:
+            try:
+                result = self.job(db, self.progress.emit)
+            except Exception as error:
+                result = {"failed": str(error)}
+            db.close()
+        del db
+        QSqlDatabase.removeDatabase(name)
+        self.finished_with.emit(result)
+
+class WriteQueue(QObject):
+    """Single-row writes on the GUI connection, committed in groups.
+
+    Statements are prepared once per (operation, table, fields) shape and kept.
+    A write runs at once inside an open transaction, so reads on the same
+    connection (availability checks, model pages) see it and its error is known
+    immediately; only the commit is deferred, until MAX_ROWS writes are pending
+    or MAX_DELAY_MS after the first one. A burst of saves then costs one commit
+    instead of one per row. Anything else starting a transaction on the
+    connection, or reading it from another connection, calls flush() first.
+    """
+    MAX_ROWS = 500
+    MAX_DELAY_MS = 50
+    commit_failed = pyqtSignal(str) #the whole group was rolled back
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.statements = {} #(operation, table, fields) -> prepared QSqlQuery
+        self.pending = 0 #writes in the open transaction
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.MAX_DELAY_MS)
+        self.timer.timeout.connect(self.flush)
+
+    def statement(self, operation, table, fields=()):
+        key = (operation, table, tuple(fields))
+        query = self.statements.get(key)
+        if query is None:
+            if operation == "insert":
+                sql = f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join(['?'] * len(fields))})"
+            elif operation == "update":
+                sql = f"UPDATE {table} SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?"
+            else:
+                sql = f"DELETE FROM {table} WHERE id = ?"
+            query = QSqlQuery(self.db)
+            query.prepare(sql)
+            self.statements[key] = query
+        return query
+
+    def write(self, operation, table, fields, values):
+        """Run one write in the current group. Returns (ok, new id or changed rows, error text)."""
+        if self.pending == 0 and not self.db.transaction():
+            return False, None, self.db.lastError().text()
+        query = self.statement(operation, table, fields)
+        for position, value in enumerate(values):
+            query.bindValue(position, value)
+        with METRICS.timer(f"write.{table}.{operation}"):
+            ok = query.exec()
+        self.pending += 1
+        if not ok:
+            METRICS.increment(f"write.{table}.failed")
+            result = (False, None, query.lastError().text())
+        else:
+            result = (True, query.lastInsertId() if operation == "insert" else query.numRowsAffected(), "")
+        if self.pending >= self.MAX_ROWS:
+            self.flush()
+        elif not self.timer.isActive():
+            self.timer.start()
+        return result
+
+    def insert(self, table, fields, values):
+        return self.write("insert", table, fields, values)
+
+    def update(self, table, record_id, fields, values):
+        return self.write("update", table, fields, list(values) + [record_id])
+
+    def delete(self, table, record_id):
+        return self.write("delete", table, (), [record_id])
+
+    #batch writes commit the open group first, then run as one execBatch in a transaction of their own
+    def delete_many(self, table, record_ids):
+        return self.write_batch("delete", table, (), [list(record_ids)])
+
+    def update_many(self, table, record_ids, field, value, check=None):
+        return self.write_batch("update", table, [field], [[value] * len(record_ids), list(record_ids)], check)
+
+    def write_batch(self, operation, table, fields, columns, check=None):
+        """Returns (ok, written rows, error text); check(db) may return an error text, which rolls the batch back."""
+        if not self.flush():
+            return False, None, "Earlier changes could not be saved."
+        if not self.db.transaction():
+            return False, None, self.db.lastError().text()
+        try:
+            #execBatch only reports the rows of its last run, so the matching ids are counted up front
+            count = QSqlQuery(self.db)
+            count.prepare(f"SELECT COUNT(*) FROM {table} WHERE id IN (SELECT value FROM json_each(?))")
+            count.addBindValue(json.dumps(list(columns[-1])))
+            rows = count.value(0) if count.exec() and count.next() else len(columns[-1])
+            count.finish()
+            query = self.statement(operation, table, fields)
+            for position, column in enumerate(columns):
+                query.bindValue(position, column)
+            with METRICS.timer(f"write.{table}.batch_{operation}") as sample:
+                ok = query.execBatch()
+                sample["rows"] = len(columns[-1])
+            if not ok:
+                METRICS.increment(f"write.{table}.failed")
+                error = query.lastError().text()
+            else:
+                error = check(self.db) if check is not None else None
+        except Exception as exception:
+            #an exception escaping a slot aborts the app, and would leave the transaction open
+            error = str(exception) or repr(exception)
+        if error:
+            self.db.rollback()
+            return False, None, error
+        self.db.commit()
+        return True, rows, ""
+
+    def flush(self):
+        """Commit the open group, if any. Returns False when the commit failed and the group was lost."""
+        self.timer.stop()
+        if self.pending == 0:
+            return True
+        with METRICS.timer("write.group_commit") as sample:
+            sample["rows"] = self.pending
+            self.pending = 0
+            if self.db.commit():
+                return True
+        error = self.db.lastError().text()
+        METRICS.increment("write.group_commit.failed")
+        print("Failed to commit writes:", error)
+        self.db.rollback()
+        self.commit_failed.emit(error)
+        return False
+
+class ServiceWriteQueue(QObject):
+    """WriteQueue look-alike sending the GUI's writes to lending_service.py.
+
+    The service is then the only writer of the db file; the GUI keeps reading its
+    own connection, which sees a write as soon as the call returns, since the
+    service commits before answering. Constraint, delete rule and availability
+    errors come back as the answer's error text.
+    """
+    commit_failed = pyqtSignal(str) #never emitted, there is no open group to lose
+
+    def __init__(self, url, parent=None):
+        super().__init__(parent)
+        parts = urllib.parse.urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.pending = 0
+
+    def request(self, method, path, body=None):
+        """Returns (ok, decoded answer, error text)."""
+        headers = {"Content-Type": "application/json"}
+        #a kept-alive connection the service dropped is retried once, except for inserts which could then happen twice
+        for attempt in range(1 if method == "POST" else 2):
+            try:
+                self.connection.request(method, path, None if body is None else json.dumps(body), headers)
+                response = self.connection.getresponse()
+                answer = json.loads(response.read() or b"null")
+                break
+            except (http.client.HTTPException, OSError, ValueError) as error:
+                self.connection.close()
+                failure = f"Lending service unreachable: {error}"
+        else:
+            METRICS.increment("write.service.failed")
+            return False, None, failure
+        if response.status >= 400:
+            METRICS.increment("write.service.failed")
+            return False, None, answer.get("error", response.reason) if isinstance(answer, dict) else response.reason
+        return True, answer, ""
+
+    def insert(self, table, fields, values):
+        with METRICS.timer(f"write.{table}.insert"):
+            ok, answer, error = self.request("POST", f"/{table}", dict(zip(fields, values)))
+        return ok, answer["id"] if ok else None, error
+
+    def update(self, table, record_id, fields, values):
+        with METRICS.timer(f"write.{table}.update"):
+            ok, answer, error = self.request("PATCH", f"/{table}/{record_id}", dict(zip(fields, values)))
+        return ok, answer["updated"] if ok else None, error
+
+    def delete(self, table, record_id):
+        with METRICS.timer(f"write.{table}.delete"):
+            ok, answer, error = self.request("DELETE", f"/{table}/{record_id}")
+        return ok, answer["deleted"] if ok else None, error
+
+    def delete_many(self, table, record_ids):
+        with METRICS.timer(f"write.{table}.batch_delete") as sample:
+            sample["rows"] = len(record_ids)
+            ok, answer, error = self.request("DELETE", f"/{table}", {"ids": list(record_ids)})
+        return ok, answer["deleted"] if ok else None, error
+
+    #the service runs the availability check of lending batches itself
+    def update_many(self, table, record_ids, field, value, check=None):
+        with METRICS.timer(f"write.{table}.batch_update") as sample:
+            sample["rows"] = len(record_ids)
+            ok, answer, error = self.request("PATCH", f"/{table}", {"ids": list(record_ids), "changes": {field: value}})
+        return ok, answer["updated"] if ok else None, error
+
+    def flush(self):
+        return True
+
+class LazyTableModel(QAbstractTableModel):
+    """Read-only model over a db table that only fetches the rows being looked at.
+
+    Rows are fetched in pages located with keyset pagination on (sort column, id)
+    and kept in a bounded LRU cache, so memory stays flat however large the table
+    grows. Sorting is an indexed ORDER BY in the db, never done on fetched rows.
+    The row count comes from a COUNT(*) query instead of from fetched rows.
+    An optional filter (an SQL condition) is applied to every query.
+    """
+    PAGE_SIZE = 256
+    MAX_PAGES = 64 #cached pages, older ones are evicted
+
+    def __init__(self, db, table, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table = table
+        record = db.record(table)
+        self.columns = [record.fieldName(i) for i in range(record.count())]
+        self.id_column = self.columns.index("id")
+        self.pages = OrderedDict() #page number -> list of row tuples
+        self.filter_sql = "" #SQL condition limiting the rows shown, "" for all rows
+        self.filter_params = []
+        self.sort_column = "id" #ORDER BY column, rows with equal values are ordered by id
+        self.sort_order = Qt.SortOrder.AscendingOrder
+        self.sort_has_nulls = False
+        self.row_count = self.count_rows()
+
+    def set_filter(self, condition="", params=()):
+        if condition == self.filter_sql and list(params) == self.filter_params:
+            return
+        self.filter_sql = condition
+        self.filter_params = list(params)
+        self.refresh()
+
+    #called by the view on header clicks, the sort is kept across refreshes
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        name = self.columns[column] if 0 <= column < len(self.columns) else "id"
+        if (name, order) == (self.sort_column, self.sort_order):
+            return
+        self.sort_column = name
+        self.sort_order = order
+        self.refresh()
+
+    def sort_key(self, row):
+        return row[self.columns.index(self.sort_column)], row[self.id_column]
+
+    def order_by(self, reverse=False):
+        direction = " DESC" if (self.sort_order == Qt.SortOrder.DescendingOrder) != reverse else ""
+        if self.sort_column == "id":
+            return f" ORDER BY id{direction}"
+        return f" ORDER BY {self.sort_column}{direction}, id{direction}"
+
+    def keyset_condition(self, key, later, inclusive=False):
+        """Condition and values selecting the rows after (or before) a (sort value, id) key in display order."""
+        value, record_id = key
+        op = (">" if later == (self.sort_order == Qt.SortOrder.AscendingOrder) else "<") + ("=" if inclusive else "")
+        if self.sort_column == "id":
+            return f"id {op} ?", [record_id]
+        column = self.sort_column
+        #NULLs sort before every value but never compare true, so they get their own terms
+        if value is None:
+            if op.startswith(">"):
+                return f"({column} IS NULL AND id {op} ?) OR {column} IS NOT NULL", [record_id]
+            return f"{column} IS NULL AND id {op} ?", [record_id]
+        condition = f"({column}, id) {op} (?, ?)"
+        if op.startswith("<") and self.sort_has_nulls:
+            condition += f" OR {column} IS NULL"
+        return condition, [value, record_id]
+
+    #whether the sort column holds NULLs, only then do keyset conditions need the slower NULL terms
+    def column_has_nulls(self):
+        if self.sort_column == "id":
+            return False
+        query = QSqlQuery(f"SELECT EXISTS (SELECT 1 FROM {self.table} WHERE {self.sort_column} IS NULL)", self.db)
+        return bool(query.value(0)) if query.next() else False
+
+    #building a query whose WHERE clause combines the filter with an extra condition
+    def prepare(self, sql, condition=None, tail="", values=()):
+        conditions = [c for c in (self.filter_sql, condition) if c]
+        where = f" WHERE ({') AND ('.join(conditions)})" if conditions else ""
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.prepare(sql + where + tail)
+        for value in (self.filter_params if self.filter_sql else []) + list(values):
+            query.addBindValue(value)
+        return query
+
+    def count_rows(self):
+        query = self.prepare(f"SELECT COUNT(*) FROM {self.table}")
+        with METRICS.timer(f"query.{self.table}.count"):
+            if not query.exec():
+                print(f"Failed to count rows of {self.table}:", query.lastError().text())
+                return 0
+            return query.value(0) if query.next() else 0
+
+    #dropping all cached rows and re-counting
+    def refresh(self):
+        METRICS.increment(f"model.{self.table}.resets")
+        self.beginResetModel()
+        self.pages.clear()
+        self.sort_has_nulls = self.column_has_nulls()
+        self.row_count = self.count_rows()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return None
+        row = self.row_data(index.row())
+        return row[index.column()] if row is not None else None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.columns[section] if section < len(self.columns) else None
+        return section + 1
+
+    def row_data(self, row):
+        if row < 0 or row >= self.row_count:
+            return None
+        page_number = row // self.PAGE_SIZE
+        page = self.pages.get(page_number)
+        if page is None:
+            page = self.fetch_page(page_number)
+            self.pages[page_number] = page
+            while len(self.pages) > self.MAX_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page_number)
+        offset = row - page_number * self.PAGE_SIZE
+        return page[offset] if offset < len(page) else None
+
+    def fetch_page(self, page_number):
+        start = page_number * self.PAGE_SIZE
+        size = min(self.PAGE_SIZE, self.row_count - start)
+        previous = self.pages.get(page_number - 1)
+        following = self.pages.get(page_number + 1)
+        select = f"SELECT {', '.join(self.columns)} FROM {self.table}"
+
+        backwards = False
+        if previous:
+            #scrolling down: continuing right after the last row of the previous page
+            condition, values = self.keyset_condition(self.sort_key(previous[-1]), later=True)
+            query = self.prepare(select, condition, self.order_by() + " LIMIT ?", values + [size])
+        elif following:
+            #scrolling up: reading backwards from the first row of the next page
+            condition, values = self.keyset_condition(self.sort_key(following[0]), later=False)
+            query = self.prepare(select, condition, self.order_by(reverse=True) + " LIMIT ?", values + [size])
+            backwards = True
+        elif start <= self.row_count - (start + size):
+            #jump without a cached neighbour, counting from whichever end is closer
+            query = self.prepare(select, None, self.order_by() + f" LIMIT ? OFFSET {start}", [size])
+        else:
+            query = self.prepare(select, None, self.order_by(reverse=True) + f" LIMIT ? OFFSET {self.row_count - start - size}", [size])
+            backwards = True
+
+        rows = []
+        with METRICS.timer(f"query.{self.table}.page") as sample:
+            if not query.exec():
+                print(f"Failed to fetch rows from {self.table}:", query.lastError().text())
+                return rows
+            while query.next():
+                rows.append(self.read_row(query))
+            sample["rows"] = len(rows)
+        if backwards:
+            rows.reverse()
+        return rows
+
+    #QSqlQuery.value() turns NULL into "", which would be mistaken for a real value in sort keys
+    def read_row(self, query):
+        return tuple(None if query.isNull(i) else query.value(i) for i in range(len(self.columns)))
+
+    def fetch_record(self, record_id):
+        query = self.prepare(f"SELECT {', '.join(self.columns)} FROM {self.table}", "id = ?", values=[record_id])
+        if query.exec() and query.next():
+            return self.read_row(query)
+        return None
+
+    def cached_row(self, record_id):
+        for page_number, page in self.pages.items():
+            if not page:
+                continue
+            low, high = sorted((page[0][self.id_column], page[-1][self.id_column]))
+            if self.sort_column != "id" or low <= record_id <= high:
+                for offset, row in enumerate(page):
+                    if row[self.id_column] == record_id:
+                        return page_number * self.PAGE_SIZE + offset
+        return None
+
+    #single-row notifications applied after a write, instead of re-selecting the table;
+    #with a filter active a write can change which rows match, so the model is re-counted
+    def insert_record(self, record_id):
+        row = None
+        record = self.fetch_record(record_id) if self.sort_column != "id" and not self.filter_sql else None
+        if not self.filter_sql and (record is not None or self.sort_column == "id"):
+            key = self.sort_key(record) if record else (record_id, record_id)
+            self.sort_has_nulls = self.sort_has_nulls or key[0] is None
+            #new ids are normally the highest, making the new row the last one without counting rows
+            condition, values = self.keyset_condition(key, later=True)
+            query = self.prepare(f"SELECT 1 FROM {self.table}", condition, " LIMIT 1", values)
+            #counting the rows before an inserted one would be O(n), anywhere but the end is a refresh
+            row = self.row_count if query.exec() and not query.next() else None
+        if row is None:
+            self.refresh()
+            return
+        METRICS.increment(f"model.{self.table}.row_notifications")
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.row_count += 1
+        self.drop_pages_from(row)
+        self.endInsertRows()
+
+    def update_record(self, record_id):
+        if self.filter_sql:
+            self.refresh()
+            return
+        row = self.cached_row(record_id)
+        if row is None:
+            #a new sort value can move an uncached row past cached ones,
+            #otherwise the row is read from the db whenever it is shown again
+            if self.sort_column != "id":
+                self.refresh()
+            return
+        page = self.pages.get(row // self.PAGE_SIZE)
+        offset = row % self.PAGE_SIZE
+        if page is not None and offset < len(page) and page[offset][self.id_column] == record_id:
+            record = self.fetch_record(record_id)
+            if record is not None:
+                if self.sort_key(record) != self.sort_key(page[offset]):
+                    self.refresh()
+                    return
+                page[offset] = record
+        METRICS.increment(f"model.{self.table}.row_notifications")
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+
+    #batch writes get a single notification: one row range when the records were adjacent, else a reset
+    def remove_records(self, record_ids, deleted):
+        """Notify views that the records were deleted (called after the delete with the deleted row count)."""
+        if not deleted:
+            return
+        if self.filter_sql or self.sort_column != "id" or deleted != len(record_ids):
+            self.refresh()
+            return
+        low, high = min(record_ids), max(record_ids)
+        #adjacent if no surviving row lies between the lowest and the highest deleted id
+        query = self.prepare(f"SELECT COUNT(*) FROM {self.table}", "id > ? AND id < ?", values=[low, high])
+        between = query.value(0) if query.exec() and query.next() else None
+        row = self.cached_row(low if self.sort_order == Qt.SortOrder.AscendingOrder else high)
+        if between != 0 or row is None or row + len(record_ids) > self.row_count:
+            self.refresh()
+            return
+        METRICS.increment(f"model.{self.table}.row_notifications")
+        self.beginRemoveRows(QModelIndex(), row, row + len(record_ids) - 1)
+        self.row_count -= len(record_ids)
+        self.drop_pages_from(row)
+        self.endRemoveRows()
+
+    def update_records(self, record_ids):
+        if self.filter_sql or self.sort_column != "id" or not record_ids:
+            self.refresh()
+            return
+        rows = [self.cached_row(min(record_ids)), self.cached_row(max(record_ids))]
+        if None in rows:
+            self.refresh()
+            return
+        first, last = min(rows), max(rows)
+        for page_number in range(first // self.PAGE_SIZE, last // self.PAGE_SIZE + 1):
+            self.pages.pop(page_number, None)
+        METRICS.increment(f"model.{self.table}.row_notifications")
+        self.dataChanged.emit(self.index(first, 0), self.index(last, len(self.columns) - 1))
+
+    def ids_in_rows(self, first, last):
+        """Ids of the rows first..last, read with one keyset query from the key of the first row."""
+        row = self.row_data(first)
+        if row is None:
+            return []
+        condition, values = self.keyset_condition(self.sort_key(row), later=True, inclusive=True)
+        query = self.prepare(f"SELECT id FROM {self.table}", condition, self.order_by() + " LIMIT ?", values + [last - first + 1])
+        ids = []
+        if query.exec():
+            while query.next():
+                ids.append(query.value(0))
+        return ids
+
+    #rows from this one on moved by one position, so their cached pages are stale
+    def drop_pages_from(self, row):
+        first_page = row // self.PAGE_SIZE
+        for page_number in [number for number in self.pages if number >= first_page]:
+            del self.pages[page_number]
+
+#human-readable label of a picker entry, as an SQL expression per table; || gives NULL for
+#a NULL operand, so the optional parts are left out instead of blanking the whole label
+PICKER_LABELS = {
+    "customers": "COALESCE(name, '') || COALESCE(' <' || email || '>', '')",
+    "cars": "COALESCE(make, '') || COALESCE(' ' || model, '') || COALESCE(' ' || year, '')",
+}
+
+def table_has_rows(db, table):
+    query = QSqlQuery(f"SELECT EXISTS (SELECT 1 FROM {table})", db)
+    return bool(query.value(0)) if query.next() else False
+
+class PickerModel(QAbstractListModel):
+    """Completion list for a RecordPicker, fetched from the db a page at a time.
+
+    Matches come from the full-text prefix index (plus an exact id match for
+    numbers) and are paged with keyset pagination on id. Results of recent
+    searches are kept in a small shared cache.
+    """
+    PAGE_SIZE = 50
+    CACHE_SIZE = 32 #searches remembered per table
+
+    def __init__(self, db, table, cache, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table = table
+        self.cache = cache #text -> (rows, exhausted), shared by the pickers of a table
+        self.text = None
+        self.rows = [] #(id, label)
+        self.exhausted = True
+
+    def set_text(self, text):
+        text = text.strip()
+        if text == self.text:
+            return
+        self.beginResetModel()
+        self.text = text
+        if text in self.cache:
+            self.rows, self.exhausted = self.cache[text]
+        else:
+            self.rows = []
+            self.rows = self.fetch_page()
+            self.exhausted = len(self.rows) < self.PAGE_SIZE
+        self.remember()
+        self.endResetModel()
+
+    def remember(self):
+        self.cache[self.text] = (self.rows, self.exhausted)
+        self.cache.move_to_end(self.text)
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def fetch_page(self):
+        """Return the next page of matches after the rows already loaded."""
+        condition, params = search_condition(self.db, self.table, self.text)
+        if self.text.lstrip("#").isdigit():
+            condition = f"id = ? OR {condition}" if condition else "id = ?"
+            params = [int(self.text.lstrip("#"))] + params
+        where = f"({condition}) AND id > ?" if condition else "id > ?"
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.prepare(f"SELECT id, {PICKER_LABELS[self.table]} FROM {self.table} WHERE {where} ORDER BY id LIMIT ?")
+        for value in params + [self.rows[-1][0] if self.rows else 0, self.PAGE_SIZE]:
+            query.addBindValue(value)
+        fetched = []
+        with METRICS.timer(f"query.{self.table}.picker") as sample:
+            if not query.exec():
+                print(f"Failed to search {self.table}:", query.lastError().text())
+                return fetched
+            while query.next():
+                fetched.append((query.value(0), f"{query.value(1)} (#{query.value(0)})"))
+            sample["rows"] = len(fetched)
+        return fetched
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self.rows[index.row()][1]
+        return None
+
+    #the completer popup asks for more rows when it is scrolled to the bottom
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        fetched = self.fetch_page()
+        self.exhausted = len(fetched) < self.PAGE_SIZE
+        if fetched:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(fetched) - 1)
+            self.rows = self.rows + fetched #cached lists are never mutated in place
+            self.endInsertRows()
+        self.remember()
+
+    def label_of(self, record_id):
+        query = QSqlQuery(self.db)
+        query.prepare(f"SELECT {PICKER_LABELS[self.table]} FROM {self.table} WHERE id = ?")
+        query.addBindValue(record_id)
+        if query.exec() and query.next():
+            return f"{query.value(0)} (#{record_id})"
+        return None
+
+class RecordPicker(QLineEdit):
+    """Picks a customer or car by typing part of its name (or its id) instead of a bare id."""
+
+    def __init__(self, db, table, cache, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table = table
+        self.setPlaceholderText("Type a name or #id...")
+        self.picker_model = PickerModel(db, table, cache, self)
+        completer = QCompleter(self.picker_model, self)
+        #the model is already filtered by the db, the completer shows it as is
+        completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        completer.setMaxVisibleItems(12)
+        self.setCompleter(completer)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.update_completions)
+        self.textEdited.connect(self.search_timer.start)
+
+    def update_completions(self):
+        self.picker_model.set_text(self.text())
+        self.completer().complete()
+
+    def set_value(self, record_id):
+        label = self.picker_model.label_of(record_id)
+        self.setText(label if label is not None else f"#{record_id}")
+
+    def value(self):
+        """Return the picked id, None if the text doesn't name an existing record."""
+        match = re.search(r"#(\d+)\)?\s*$", self.text()) or re.fullmatch(r"\s*(\d+)\s*", self.text())
+        if match is None:
+            return None
+        record_id = int(match.group(1))
+        return record_id if self.picker_model.label_of(record_id) is not None else None
+
+class CarLendingApp(QWidget):
+    def __init__(self, service_url=None):
         super().__init__()
         self.setWindowTitle("Car Lending Management System")
         self.setGeometry(100, 100, 1200, 600)
         
         self.db = self.init_db()
+        #single-row writes, committed in groups, or sent to the lending service
+        service_url = service_url or SERVICE_URL
+        self.writes = ServiceWriteQueue(service_url, self) if service_url else WriteQueue(self.db, self)
+        self.writes.commit_failed.connect(self.on_commit_failed)
+        self.models = {} #one persistent table model per table
+        self.db_tasks = [] #background db jobs still running
+        self.picker_caches = {"customers": OrderedDict(), "cars": OrderedDict()} #recent picker searches
+        self.lending_snapshot = LendingSnapshot() #read when the analytics are first shown
+        self.snapshot_data_version = None
         
         #initializing the timer for real-time graph updates
         self.graph_timer = QTimer(self)
         self.graph_timer.setInterval(2000) #every 2 secs
-        self.graph_timer.timeout.connect(self.refresh_graph)
+        self.graph_timer.timeout.connect(self.on_graph_timer)
         
         self.init_ui()
+        self.init_metrics()
         
     def init_db(self):
-        db = QSqlDatabase.addDatabase("QSQLITE")
-        db.setDatabaseName("car_lending.db")
-        if not db.open():
-            print("Unable to open database")
-            sys.exit(1)
-        
-        query = QSqlQuery()
-        query.exec("""
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                email TEXT
-            )
-        """)
-        query.exec("""
-            CREATE TABLE IF NOT EXISTS cars (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                make TEXT,
-                model TEXT,
-                year INTEGER
-            )
-        """)
-        query.exec("""
-            CREATE TABLE IF NOT EXISTS lendings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER,
-                car_id INTEGER,
-                lending_date TEXT,
-                return_date TEXT,
-                FOREIGN KEY(customer_id) REFERENCES customers(id),
-                FOREIGN KEY(car_id) REFERENCES cars(id)
-            )
-        """)
+        with METRICS.timer("startup.init_db"):
+            db = open_connection()
+            if db is None:
+                print("Unable to open database")
+                sys.exit(1)
+            
+            create_schema(db)
+            migrate_db(db)
+            check_query_plans(db)
         
         return db
 
@@ -142,30 +2121,57 @@ class CarLendingApp(QWidget):
         customers_button = QPushButton("Customers")
         cars_button = QPushButton("Cars")
         lendings_button = QPushButton("Lendings")
+        delete_rules_button = QPushButton("Delete Rules")
 
         #switching buttons
         button_layout.addWidget(customers_button)
         button_layout.addWidget(cars_button)
         button_layout.addWidget(lendings_button)
+        button_layout.addWidget(delete_rules_button)
+        delete_rules_button.clicked.connect(self.edit_delete_rules)
 
         #connecting buttons to switching views
         customers_button.clicked.connect(lambda: self.stacked_layout.setCurrentIndex(0)) #customers
         cars_button.clicked.connect(lambda: self.stacked_layout.setCurrentIndex(1)) #cars
         lendings_button.clicked.connect(lambda: self.stacked_layout.setCurrentIndex(2)) #lendnings
 
-        #initializing views
-        self.init_customers_view()
-        self.init_cars_view()
-        self.init_lendings_view()
+        #one page per view; cars and lendings are only built when first switched to
+        self.view_builders = [self.init_customers_view, self.init_cars_view, self.init_lendings_view]
+        self.view_pages = []
+        for _ in self.view_builders:
+            page = QWidget()
+            page_layout = QVBoxLayout()
+            page_layout.setContentsMargins(0, 0, 0, 0)
+            page.setLayout(page_layout)
+            self.stacked_layout.addWidget(page)
+            self.view_pages.append(page)
+        self.stacked_layout.currentChanged.connect(self.ensure_view)
+        self.ensure_view(0)
+
+    #building a view the first time it is needed
+    def ensure_view(self, index):
+        builder = self.view_builders[index]
+        if builder is not None:
+            self.view_builders[index] = None
+            builder()
 
     #initializing customers view
     def init_customers_view(self):
         customers_widget = QWidget()
         customers_layout = QVBoxLayout()
         customers_widget.setLayout(customers_layout)
+
+        #search box, filtering in the db once typing pauses
+        self.customers_search = QLineEdit()
+        self.customers_search.setPlaceholderText("Search name or email...")
+        self.customers_search_timer = self.make_search_timer("customers")
+        self.customers_search.textChanged.connect(self.customers_search_timer.start)
+        customers_layout.addWidget(self.customers_search)
         
         self.customers_table = QTableView() #table to store customers
         self.customers_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.customers_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.customers_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.customers_table.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         customers_layout.addWidget(self.customers_table, 1)
         
@@ -175,17 +2181,23 @@ class CarLendingApp(QWidget):
         add_button = QPushButton("Add Customer")
         edit_button = QPushButton("Edit Customer")
         delete_button = QPushButton("Delete Customer")
+        import_button = QPushButton("Import Customers")
+        export_button = QPushButton("Export Customers")
         buttons_layout.addWidget(add_button)
 
         buttons_layout.addWidget(edit_button)
         buttons_layout.addWidget(delete_button)
+        buttons_layout.addWidget(import_button)
+        buttons_layout.addWidget(export_button)
         customers_layout.addLayout(buttons_layout)
         
         add_button.clicked.connect(self.add_customer_record)
         edit_button.clicked.connect(self.edit_customer_record)
         delete_button.clicked.connect(self.delete_customer_record)
+        import_button.clicked.connect(lambda: self.import_file("customers"))
+        export_button.clicked.connect(lambda: self.export_file("customers"))
         
-        self.stacked_layout.addWidget(customers_widget)
+        self.view_pages[0].layout().addWidget(customers_widget)
         
         self.load_record_data("customers")
 
@@ -194,9 +2206,18 @@ class CarLendingApp(QWidget):
         cars_widget = QWidget()
         cars_layout = QVBoxLayout()
         cars_widget.setLayout(cars_layout)
+
+        #search box, filtering in the db once typing pauses
+        self.cars_search = QLineEdit()
+        self.cars_search.setPlaceholderText("Search make or model...")
+        self.cars_search_timer = self.make_search_timer("cars")
+        self.cars_search.textChanged.connect(self.cars_search_timer.start)
+        cars_layout.addWidget(self.cars_search)
         
         self.cars_table = QTableView()
         self.cars_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.cars_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.cars_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.cars_table.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         cars_layout.addWidget(self.cars_table, 1)
         
@@ -206,17 +2227,23 @@ class CarLendingApp(QWidget):
         add_button = QPushButton("Add Car")
         edit_button = QPushButton("Edit Car")
         delete_button = QPushButton("Delete Car")
+        import_button = QPushButton("Import Cars")
+        export_button = QPushButton("Export Cars")
 
         buttons_layout.addWidget(add_button)
         buttons_layout.addWidget(edit_button)
         buttons_layout.addWidget(delete_button)
+        buttons_layout.addWidget(import_button)
+        buttons_layout.addWidget(export_button)
         cars_layout.addLayout(buttons_layout)
         
         add_button.clicked.connect(self.add_car_record)
         edit_button.clicked.connect(self.edit_car_record)
         delete_button.clicked.connect(self.delete_car_record)
+        import_button.clicked.connect(lambda: self.import_file("cars"))
+        export_button.clicked.connect(lambda: self.export_file("cars"))
         
-        self.stacked_layout.addWidget(cars_widget)
+        self.view_pages[1].layout().addWidget(cars_widget)
         
         self.load_record_data("cars")
         
@@ -226,11 +2253,44 @@ class CarLendingApp(QWidget):
         lendings_layout = QVBoxLayout()
         lendings_widget.setLayout(lendings_layout)
 
+        #filter bar: lending date range and customer/car id, the minimum value means "any"
+        filter_layout = QHBoxLayout()
+        self.lendings_from = QDateEdit()
+        self.lendings_to = QDateEdit()
+        for date_input in (self.lendings_from, self.lendings_to):
+            date_input.setCalendarPopup(True)
+            date_input.setDisplayFormat(DATE_FORMAT)
+            date_input.setMinimumDate(QtCore.QDate(1900, 1, 1))
+            date_input.setSpecialValueText("Any")
+            date_input.setDate(date_input.minimumDate())
+        self.lendings_customer_filter = QSpinBox()
+        self.lendings_car_filter = QSpinBox()
+        for id_input in (self.lendings_customer_filter, self.lendings_car_filter):
+            id_input.setRange(0, 2147483647)
+            id_input.setSpecialValueText("Any")
+        self.lendings_search_timer = self.make_search_timer("lendings")
+        self.lendings_from.dateChanged.connect(self.lendings_search_timer.start)
+        self.lendings_to.dateChanged.connect(self.lendings_search_timer.start)
+        self.lendings_customer_filter.valueChanged.connect(self.lendings_search_timer.start)
+        self.lendings_car_filter.valueChanged.connect(self.lendings_search_timer.start)
+        filter_layout.addWidget(QLabel("From:"))
+        filter_layout.addWidget(self.lendings_from)
+        filter_layout.addWidget(QLabel("To:"))
+        filter_layout.addWidget(self.lendings_to)
+        filter_layout.addWidget(QLabel("Customer ID:"))
+        filter_layout.addWidget(self.lendings_customer_filter)
+        filter_layout.addWidget(QLabel("Car ID:"))
+        filter_layout.addWidget(self.lendings_car_filter)
+        filter_layout.addStretch(1)
+        lendings_layout.addLayout(filter_layout)
+
         table_graph_layout = QHBoxLayout()
         lendings_layout.addLayout(table_graph_layout)
     
         self.lendings_table = QTableView()
         self.lendings_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.lendings_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.lendings_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.lendings_table.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         #give the graph more horizontal space (table:graph = 1:2)
         table_graph_layout.addWidget(self.lendings_table, 1)
@@ -242,6 +2302,10 @@ class CarLendingApp(QWidget):
         self.graph_widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         table_graph_layout.addWidget(self.graph_widget, 1)
         
+        #matplotlib is only loaded once the lendings view is shown, keeping startup fast
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+        from matplotlib.figure import Figure
+
         #creating figure and canvas once, reusing for updates
         self.fig = Figure(figsize=(5, 4), dpi=100)
         #setting figure background to match dark UI
@@ -258,39 +2322,72 @@ class CarLendingApp(QWidget):
         self.ax.yaxis.label.set_color('#d4d7db')
         self.ax.title.set_color('#e0e0e0')
         self.graph_layout.addWidget(self.canvas)
+        self.canvas.mpl_connect('resize_event', self.on_canvas_resize)
+
+        #artists of the chart currently shown, reused until the type or categories change
+        self.graph_artists = None
+        self.graph_series = None
+        self.graph_background = None
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
 
         #combobox for selecting graph type
         self.graph_type_combo = QComboBox()
         self.graph_type_combo.addItems(["Bar Chart", "Pie Chart", "Line Graph"])
         self.graph_type_combo.currentTextChanged.connect(lambda: self.refresh_graph())
 
+        #grouping dates into days/weeks/months, and how many pie slices to show
+        self.graph_bucket_combo = QComboBox()
+        self.graph_bucket_combo.addItems(GRAPH_BUCKETS)
+        self.graph_bucket_combo.currentTextChanged.connect(lambda: self.refresh_graph())
+        self.pie_top_spin = QSpinBox()
+        self.pie_top_spin.setRange(0, 50)
+        self.pie_top_spin.setSpecialValueText("All")
+        self.pie_top_spin.setValue(10)
+        self.pie_top_spin.valueChanged.connect(lambda: self.refresh_graph())
+
         #title customization input
         self.title_input = QLineEdit()
         self.title_input.setPlaceholderText("Custom Title (optional)")
-        self.title_input.textChanged.connect(lambda: self.refresh_graph())
+        self.title_input.textChanged.connect(lambda: self.restyle_graph())
 
         #color selector
         self.color_combo = QComboBox()
         #include a set of named colors and hex values
         self.color_combo.addItems(["blue", "green", "orange", "red", "purple", "yellow"]) 
-        self.color_combo.currentTextChanged.connect(lambda: self.refresh_graph())
+        self.color_combo.currentTextChanged.connect(lambda: self.restyle_graph())
 
         #button for showing the graph
         self.show_graph_button = QPushButton("Show Lending Graph")
         self.show_graph_button.clicked.connect(lambda: self.refresh_graph())
         buttons_layout = QHBoxLayout()
+        free_cars_button = QPushButton("Free Cars")
+        free_cars_button.clicked.connect(self.show_free_cars)
+        analytics_button = QPushButton("Analytics")
+        analytics_button.clicked.connect(self.show_analytics)
 
         #buttons
         add_button = QPushButton("Add Lending")
         edit_button = QPushButton("Edit Lending")
         delete_button = QPushButton("Delete Lending")
+        import_button = QPushButton("Import Lendings")
+        export_button = QPushButton("Export Lendings")
+        export_graph_button = QPushButton("Export Graph Data")
 
         buttons_layout.addWidget(add_button)
         buttons_layout.addWidget(edit_button)
         buttons_layout.addWidget(delete_button)
+        buttons_layout.addWidget(import_button)
+        buttons_layout.addWidget(export_button)
         buttons_layout.addWidget(self.show_graph_button)
+        buttons_layout.addWidget(export_graph_button)
+        buttons_layout.addWidget(free_cars_button)
+        buttons_layout.addWidget(analytics_button)
         buttons_layout.addWidget(QLabel("Type:"))
         buttons_layout.addWidget(self.graph_type_combo)
+        buttons_layout.addWidget(QLabel("Group by:"))
+        buttons_layout.addWidget(self.graph_bucket_combo)
+        buttons_layout.addWidget(QLabel("Pie top:"))
+        buttons_layout.addWidget(self.pie_top_spin)
         buttons_layout.addWidget(QLabel("Title:"))
         buttons_layout.addWidget(self.title_input)
         buttons_layout.addWidget(QLabel("Color:"))
@@ -300,9 +2397,25 @@ class CarLendingApp(QWidget):
         add_button.clicked.connect(self.add_lending_record)
         edit_button.clicked.connect(self.edit_lending_record)
         delete_button.clicked.connect(self.delete_lending_record)
-        self.stacked_layout.addWidget(lendings_widget)
+        import_button.clicked.connect(lambda: self.import_file("lendings"))
+        export_button.clicked.connect(lambda: self.export_file("lendings"))
+        export_graph_button.clicked.connect(lambda: self.export_file("lending_counts"))
+        self.view_pages[2].layout().addWidget(lendings_widget)
         
         self.load_record_data("lendings")
+
+        #in-memory per-date counts, updated with deltas on every write
+        self.graph_tracker = LendingGraphTracker(self.db)
+        self.graph_tracker.external_change() #remembering the current data_version
+
+        #aggregation runs on a worker thread, results are applied on the GUI thread
+        self.graph_generation = 0 #id of the newest graph request, older results are dropped
+        self.graph_request_version = 0 #tracker version the newest request was made at
+        self.graph_reload_version = None #tracker version a pending reload was requested at
+        self.graph_worker = GraphWorker(self)
+        self.graph_worker.result_ready.connect(self.on_graph_result)
+        self.graph_worker.start()
+        self.request_graph(reload=True)
         
         #Start auto-refresh
         self.graph_timer.start()
@@ -343,10 +2456,10 @@ class CarLendingApp(QWidget):
         
         dialog.exec()
 
-        #updating the customers table view
-        self.load_record_data("customers")
-
     def edit_customer_record(self):
+        if len(self.selected_ids("customers")) > 1: #several rows selected, editing a field of all of them
+            self.batch_edit_records("customers")
+            return
         selected_index = self.customers_table.currentIndex() #getting the selected row index
         if not selected_index.isValid():
             messagebox = QDialog(self)
@@ -395,12 +2508,10 @@ class CarLendingApp(QWidget):
         save_button.clicked.connect(lambda: self.edit_record(dialog, "customers", selected_id, ["name", "email"], [name_input.text().strip(), email_input.text().strip()]))
         cancel_button.clicked.connect(dialog.reject)
         dialog.exec()
-
-        self.load_record_data("customers")
     
     def delete_customer_record(self):
-        selected_index = self.customers_table.currentIndex() #getting the selected row index
-        if not selected_index.isValid():
+        selected_ids = self.selected_ids("customers") #ids of all selected rows
+        if not selected_ids:
             messagebox = QDialog(self)
             messagebox.setWindowTitle("No Selection")
             layout = QVBoxLayout()
@@ -412,14 +2523,13 @@ class CarLendingApp(QWidget):
             messagebox.exec()
             return  #no selection made
                 
-        selected_id = self.customers_table.model().data(self.customers_table.model().index(selected_index.row(), 0))
 
         dialog = QDialog(self)
         dialog.setWindowTitle("Delete Customer")
         layout = QVBoxLayout()
         dialog.setLayout(layout)
 
-        layout.addWidget(QLabel("Are you sure you want to delete this customer?"))
+        layout.addWidget(QLabel("Are you sure you want to delete this customer?" if len(selected_ids) == 1 else f"Are you sure you want to delete these {len(selected_ids)} customers?"))
 
         buttons_layout = QHBoxLayout()
 
@@ -431,18 +2541,16 @@ class CarLendingApp(QWidget):
         buttons_layout.addWidget(cancel_button)
         layout.addLayout(buttons_layout)
 
-        delete_button.clicked.connect(lambda: self.delete_record(dialog, "customers", selected_id))
+        delete_button.clicked.connect(lambda: self.delete_records(dialog, "customers", selected_ids))
         cancel_button.clicked.connect(dialog.reject)
         dialog.exec()
 
-        self.load_record_data("customers")
-
     #---------------------------------------------------
 
     #-----------------lending methods--------------------
 
     def add_lending_record(self):
-        if self.customers_table.model().rowCount() == 0 or self.cars_table.model().rowCount() == 0: #checking if there are customers and cars in the db
+        if not table_has_rows(self.db, "customers") or not table_has_rows(self.db, "cars"): #checking if there are customers and cars in the db
             messagebox = QDialog(self)
             messagebox.setWindowTitle("Input Error")
             layout = QVBoxLayout()
@@ -462,22 +2570,22 @@ class CarLendingApp(QWidget):
         dialog.setLayout(layout)
 
         #input fields
-        customer_id_input = QSpinBox()
-        car_id_input = QSpinBox()
+        customer_id_input = RecordPicker(self.db, "customers", self.picker_caches["customers"])
+        car_id_input = RecordPicker(self.db, "cars", self.picker_caches["cars"])
         lending_date_input = QDateEdit()
         lending_date_input.setCalendarPopup(True)
+        lending_date_input.setDisplayFormat(DATE_FORMAT)
         return_date_input = QDateEdit()
         return_date_input.setCalendarPopup(True)
+        return_date_input.setDisplayFormat(DATE_FORMAT)
         
         #setting default dates to current date
         lending_date_input.setDateTime(QtCore.QDateTime.currentDateTime())
         return_date_input.setDateTime(QtCore.QDateTime.currentDateTime())
-        customer_id_input.setRange(0, self.customers_table.model().rowCount()) #setting max range to number of customers
-        car_id_input.setRange(0, self.cars_table.model().rowCount()) #setting max range to number of cars
 
-        layout.addWidget(QLabel("Customer ID:"))
+        layout.addWidget(QLabel("Customer:"))
         layout.addWidget(customer_id_input)
-        layout.addWidget(QLabel("Car ID:"))
+        layout.addWidget(QLabel("Car:"))
         layout.addWidget(car_id_input)
         layout.addWidget(QLabel("Lending Date (YYYY-MM-DD):"))
         layout.addWidget(lending_date_input)
@@ -494,15 +2602,15 @@ class CarLendingApp(QWidget):
 
         layout.addLayout(buttons_layout)
 
-        save_button.clicked.connect(lambda: self.save_new_record(dialog, "lendings", ["customer_id", "car_id", "lending_date", "return_date"], [customer_id_input.value(), car_id_input.value(), lending_date_input.text(), return_date_input.text()]))
+        save_button.clicked.connect(lambda: self.save_new_record(dialog, "lendings", ["customer_id", "car_id", "lending_date", "return_date"], [customer_id_input.value(), car_id_input.value(), lending_date_input.date().toString(DATE_FORMAT), return_date_input.date().toString(DATE_FORMAT)]))
         cancel_button.clicked.connect(dialog.reject)
 
         dialog.exec()
 
-        #updating the lendings table view
-        self.load_record_data("lendings")
-
     def edit_lending_record(self):
+        if len(self.selected_ids("lendings")) > 1: #several rows selected, editing a field of all of them
+            self.batch_edit_records("lendings")
+            return
         current_index = self.lendings_table.currentIndex()
         if not current_index.isValid():
             messagebox = QDialog(self)
@@ -525,25 +2633,25 @@ class CarLendingApp(QWidget):
         dialog.setLayout(layout)
 
         #input fields
-        customer_id_input = QSpinBox()
-        customer_id_input.setRange(0, self.customers_table.model().rowCount()) #setting max range to number of customers
-        car_id_input = QSpinBox()
-        car_id_input.setRange(0, self.cars_table.model().rowCount()) #setting max range to number of cars
+        customer_id_input = RecordPicker(self.db, "customers", self.picker_caches["customers"])
+        car_id_input = RecordPicker(self.db, "cars", self.picker_caches["cars"])
         lending_date_input = QDateEdit()
         lending_date_input.setCalendarPopup(True)
+        lending_date_input.setDisplayFormat(DATE_FORMAT)
         return_date_input = QDateEdit()
         return_date_input.setCalendarPopup(True)
+        return_date_input.setDisplayFormat(DATE_FORMAT)
         
         #setting input fields text to current data
-        customer_id_input.setValue(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 1)))
-        car_id_input.setValue(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 2)))
+        customer_id_input.set_value(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 1)))
+        car_id_input.set_value(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 2)))
         
-        lending_date_input.setDateTime(QtCore.QDateTime.fromString(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 3)), "dd.MM.yyyy"))
-        return_date_input.setDateTime(QtCore.QDateTime.fromString(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 4)), "dd.MM.yyyy"))
+        lending_date_input.setDate(QtCore.QDate.fromString(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 3)), DATE_FORMAT))
+        return_date_input.setDate(QtCore.QDate.fromString(self.lendings_table.model().data(self.lendings_table.model().index(current_index.row(), 4)), DATE_FORMAT))
 
-        layout.addWidget(QLabel("Customer ID:"))
+        layout.addWidget(QLabel("Customer:"))
         layout.addWidget(customer_id_input)
-        layout.addWidget(QLabel("Car ID:"))
+        layout.addWidget(QLabel("Car:"))
         layout.addWidget(car_id_input)
         layout.addWidget(QLabel("Lending Date (YYYY-MM-DD):"))
         layout.addWidget(lending_date_input)
@@ -557,17 +2665,15 @@ class CarLendingApp(QWidget):
         buttons_layout.addWidget(save_button)
         buttons_layout.addWidget(cancel_button)
         layout.addLayout(buttons_layout)
-        save_button.clicked.connect(lambda: self.edit_record(dialog, "lendings", selected_id, ["customer_id", "car_id", "lending_date", "return_date"], [customer_id_input.value(), car_id_input.value(), lending_date_input.text(), return_date_input.text()]))
+        save_button.clicked.connect(lambda: self.edit_record(dialog, "lendings", selected_id, ["customer_id", "car_id", "lending_date", "return_date"], [customer_id_input.value(), car_id_input.value(), lending_date_input.date().toString(DATE_FORMAT), return_date_input.date().toString(DATE_FORMAT)]))
         cancel_button.clicked.connect(dialog.reject)
 
         dialog.exec()
 
-        self.load_record_data("lendings")
-
 
     def delete_lending_record(self):
-        selected_index = self.lendings_table.currentIndex() #getting the selected row index
-        if not selected_index.isValid():
+        selected_ids = self.selected_ids("lendings") #ids of all selected rows
+        if not selected_ids:
             messagebox = QDialog(self)
             messagebox.setWindowTitle("No Selection")
             layout = QVBoxLayout()
@@ -579,12 +2685,11 @@ class CarLendingApp(QWidget):
             messagebox.exec()
             return  #no selection made
         
-        selected_id = self.lendings_table.model().data(self.lendings_table.model().index(selected_index.row(), 0))
         dialog = QDialog(self)
         dialog.setWindowTitle("Delete Lending")
         layout = QVBoxLayout()
         dialog.setLayout(layout)
-        layout.addWidget(QLabel("Are you sure you want to delete this lending record?"))
+        layout.addWidget(QLabel("Are you sure you want to delete this lending record?" if len(selected_ids) == 1 else f"Are you sure you want to delete these {len(selected_ids)} lending records?"))
         buttons_layout = QHBoxLayout()
         
         #buttons
@@ -595,14 +2700,11 @@ class CarLendingApp(QWidget):
         buttons_layout.addWidget(cancel_button)
         
         layout.addLayout(buttons_layout)
-        delete_button.clicked.connect(lambda: self.delete_record(dialog, "lendings", selected_id))
+        delete_button.clicked.connect(lambda: self.delete_records(dialog, "lendings", selected_ids))
         cancel_button.clicked.connect(dialog.reject)
         
         dialog.exec()
 
-        #updating the lendings table view
-        self.load_record_data("lendings")
-
     #---------------------------------------------
     
 
@@ -642,10 +2744,10 @@ class CarLendingApp(QWidget):
         
         dialog.exec()
 
-        #updating the cars table view
-        self.load_record_data("cars")
-
     def edit_car_record(self):
+        if len(self.selected_ids("cars")) > 1: #several rows selected, editing a field of all of them
+            self.batch_edit_records("cars")
+            return
         current_index = self.cars_table.currentIndex()
         if not current_index.isValid():
             messagebox = QDialog(self)
@@ -699,13 +2801,11 @@ class CarLendingApp(QWidget):
         cancel_button.clicked.connect(dialog.reject)
         
         dialog.exec()
-        
-        self.load_record_data("cars")
 
 
     def delete_car_record(self):
-        selected_index = self.cars_table.currentIndex() #getting the selected row index
-        if not selected_index.isValid():
+        selected_ids = self.selected_ids("cars") #ids of all selected rows
+        if not selected_ids:
             messagebox = QDialog(self)
             messagebox.setWindowTitle("No Selection")
             layout = QVBoxLayout()
@@ -717,14 +2817,13 @@ class CarLendingApp(QWidget):
             messagebox.exec()
             return  #no selection made
                 
-        selected_id = self.cars_table.model().data(self.cars_table.model().index(selected_index.row(), 0))
 
         dialog = QDialog(self)
         dialog.setWindowTitle("Delete Car")
         layout = QVBoxLayout()
         dialog.setLayout(layout)
 
-        layout.addWidget(QLabel("Are you sure you want to delete this car?"))
+        layout.addWidget(QLabel("Are you sure you want to delete this car?" if len(selected_ids) == 1 else f"Are you sure you want to delete these {len(selected_ids)} cars?"))
 
         buttons_layout = QHBoxLayout()
 
@@ -736,12 +2835,10 @@ class CarLendingApp(QWidget):
         buttons_layout.addWidget(cancel_button)
         layout.addLayout(buttons_layout)
 
-        delete_button.clicked.connect(lambda: self.delete_record(dialog, "cars", selected_id))
+        delete_button.clicked.connect(lambda: self.delete_records(dialog, "cars", selected_ids))
         
         cancel_button.clicked.connect(dialog.reject)
         dialog.exec()
-
-        self.load_record_data("cars")
     #--------------------------------------------------------------------
 
     #------------------------universal methods---------------------------
@@ -750,7 +2847,7 @@ class CarLendingApp(QWidget):
     def save_new_record(self, dialog, table, fields, values):
         #checking, if none of the values are empty
         for value in values:
-            if value == "":
+            if value == "" or value is None:
                 #throwing an error message box
                 messagebox = QDialog(self)
                 messagebox.setWindowTitle("Input Error")
@@ -761,90 +2858,536 @@ class CarLendingApp(QWidget):
                 ok_button.clicked.connect(messagebox.accept)
                 layout.addWidget(ok_button)
                 messagebox.exec()
-                dialog.reject()
                 return
+        if table == "lendings" and not self.check_car_available(fields, values):
+            return
 
-        placeholders = ", ".join(["?"] * len(values))
-        query_str = f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({placeholders})"
-        query = QSqlQuery()
-        query.prepare(query_str)
-        for value in values:
-            query.addBindValue(value)
-        if not query.exec():
-            print(f"Failed to add record to {table}:", query.lastError().text())
+        added, record_id, error = self.writes.insert(table, fields, values)
+        if not added:
+            print(f"Failed to add record to {table}:", error)
+            #the service runs the availability check itself, its refusal is already a plain message
+            self.show_message("Car Unavailable" if "is already lent" in error else "Save Failed", write_error_message(error))
         else:
+            if table == "lendings":
+                self.graph_tracker.add(values[fields.index("lending_date")], 1)
             dialog.accept()
-            self.load_record_data(table)
-
-    #universal method for loading data from a table
+            self.models[table].insert_record(record_id)
+            self.forget_picker_results(table)
+
+    #debouncing search input: the filter is applied once typing pauses
+    def make_search_timer(self, table):
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.setInterval(250)
+        timer.timeout.connect(lambda: self.apply_search(table))
+        return timer
+
+    def apply_search(self, table):
+        if table == "lendings":
+            condition, params = self.lendings_filter()
+        else:
+            condition, params = search_condition(self.db, table, getattr(self, f"{table}_search").text())
+        self.get_model(table).set_filter(condition, params)
+
+    #filter condition from the lendings filter bar, each part is an indexed lookup
+    def lendings_filter(self):
+        conditions = []
+        params = []
+        if self.lendings_from.date() != self.lendings_from.minimumDate():
+            conditions.append("lending_date >= ?")
+            params.append(self.lendings_from.date().toString(DATE_FORMAT))
+        if self.lendings_to.date() != self.lendings_to.minimumDate():
+            conditions.append("lending_date <= ?")
+            params.append(self.lendings_to.date().toString(DATE_FORMAT))
+        if self.lendings_customer_filter.value():
+            conditions.append("customer_id = ?")
+            params.append(self.lendings_customer_filter.value())
+        if self.lendings_car_filter.value():
+            conditions.append("car_id = ?")
+            params.append(self.lendings_car_filter.value())
+        return " AND ".join(conditions), params
+
+    #cached picker searches are stale once customers or cars change
+    def forget_picker_results(self, table):
+        if table in self.picker_caches:
+            self.picker_caches[table].clear()
+
+    #one persistent model per table, shared by its view and the lending dialogs
+    def get_model(self, table):
+        if table not in self.models:
+            self.models[table] = LazyTableModel(self.db, table)
+        return self.models[table]
+
+    #universal method for loading data from a table, the model is created once per table
     def load_record_data(self, table):
-        model = QtSql.QSqlTableModel()
-        model.setTable(table)
-        model.select()
-        if table == "customers":
-            self.customers_table.setModel(model)
-            try:
-                self.customers_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-            except Exception:
-                pass
-        elif table == "cars":
-            self.cars_table.setModel(model)
-            try:
-                self.cars_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-            except Exception:
-                pass
-        elif table == "lendings":
-            self.lendings_table.setModel(model)
+        with METRICS.timer(f"model.{table}.load"):
+            view = getattr(self, f"{table}_table", None)
+            if view is None or view.model() is not None:
+                self.get_model(table).refresh()
+                return
+            model = self.get_model(table)
+            view.setModel(model)
+            #header clicks sort in the db; the indicator starts at the model's current sort
+            view.horizontalHeader().setSortIndicator(model.columns.index(model.sort_column), model.sort_order)
+            view.setSortingEnabled(True)
             try:
-                self.lendings_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+                view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
             except Exception:
                 pass
 
     #universal method for editing records in the database
     def edit_record(self, dialog, table, record_id, fields, values):
-        set_clause = ", ".join([f"{field} = ?" for field in fields])
-        query_str = f"UPDATE {table} SET {set_clause} WHERE id = ?"
-        query = QSqlQuery()
-        query.prepare(query_str)
-        for value in values:
-            query.addBindValue(value)
-        query.addBindValue(record_id)
-        if not query.exec():
-            print(f"Failed to edit record in {table}:", query.lastError().text())
+        if None in values:
+            self.show_message("Input Error", "All fields must be filled out.")
+            return
+        if table == "lendings" and not self.check_car_available(fields, values, record_id):
+            return
+        old_date = self.get_lending_date(record_id) if table == "lendings" else None
+        edited, _, error = self.writes.update(table, record_id, fields, values)
+        if not edited:
+            print(f"Failed to edit record in {table}:", error)
+            #the service runs the availability check itself, its refusal is already a plain message
+            self.show_message("Car Unavailable" if "is already lent" in error else "Edit Failed", write_error_message(error))
         else:
+            if table == "lendings" and "lending_date" in fields:
+                self.graph_tracker.move(old_date, values[fields.index("lending_date")])
+            if table == "lendings":
+                self.lending_snapshot.invalidate()
             dialog.accept()
-            self.load_record_data(table)
-    
-    #universal method for deleting records from the database
-    def delete_record(self, dialog, table, record_id):
-        query_str = f"DELETE FROM {table} WHERE id = ?"
-        query = QSqlQuery()  
-        query.prepare(query_str)
-        query.addBindValue(record_id)
-        if not query.exec():
-            print(f"Failed to delete record from {table}:", query.lastError().text())
-        else:
+            self.models[table].update_record(record_id)
+            self.forget_picker_results(table)
+
+    #one prepared DELETE run over all ids in a single transaction
+    def delete_records(self, dialog, table, record_ids):
+        ok, deleted, error = self.writes.delete_many(table, record_ids)
+        if not ok:
+            if "still referenced" in error:
+                error = f"Some of the selected {table} still have lendings. Delete those first, or set the delete rule to cascade."
+            self.show_message("Delete Failed", error)
+            return
+        cascaded = any(parent == table and delete_rule(self.db, relationship) == "cascade" for relationship, parent in RELATIONSHIPS.items())
+        if table == "lendings" or cascaded:
+            self.lending_snapshot.invalidate()
+        if (table == "lendings" or cascaded) and hasattr(self, "graph_tracker"):
+            self.request_graph(reload=True) #the rollup already has the new counts
+        if cascaded and "lendings" in self.models:
+            self.models["lendings"].refresh()
+        dialog.accept()
+        self.models[table].remove_records(record_ids, deleted)
+        self.forget_picker_results(table)
+
+    #dialog choosing per relationship what deleting a referenced customer or car does
+    def edit_delete_rules(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Delete Rules")
+        layout = QVBoxLayout()
+        dialog.setLayout(layout)
+
+        combos = {}
+        for relationship, parent in RELATIONSHIPS.items():
+            combo = QComboBox()
+            combo.addItems(DELETE_RULES)
+            combo.setCurrentText(delete_rule(self.db, relationship))
+            layout.addWidget(QLabel(f"Deleting {parent} referenced by {relationship}:"))
+            layout.addWidget(combo)
+            combos[relationship] = combo
+
+        buttons_layout = QHBoxLayout()
+        save_button = QPushButton("Save")
+        cancel_button = QPushButton("Cancel")
+        buttons_layout.addWidget(save_button)
+        buttons_layout.addWidget(cancel_button)
+        layout.addLayout(buttons_layout)
+
+        def save():
+            for relationship, combo in combos.items():
+                set_delete_rule(self.db, relationship, combo.currentText())
             dialog.accept()
+
+        save_button.clicked.connect(save)
+        cancel_button.clicked.connect(dialog.reject)
+        dialog.exec()
+
+    #ids of the selected rows of a view, one query per selected range
+    def selected_ids(self, table):
+        view = getattr(self, f"{table}_table")
+        if view.selectionModel() is None:
+            return []
+        ids = set()
+        for selection_range in view.selectionModel().selection():
+            ids.update(self.get_model(table).ids_in_rows(selection_range.top(), selection_range.bottom()))
+        return sorted(ids)
+
+    #dialog setting one field to the same value on all selected rows
+    def batch_edit_records(self, table):
+        record_ids = self.selected_ids(table)
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"Edit {len(record_ids)} {table.capitalize()}")
+        layout = QVBoxLayout()
+        dialog.setLayout(layout)
+
+        field_combo = QComboBox()
+        field_combo.addItems([column for column in self.get_model(table).columns if column != "id"])
+        value_input = QLineEdit()
+        value_input.setPlaceholderText("New value (dates as yyyy-MM-dd)")
+
+        layout.addWidget(QLabel("Field:"))
+        layout.addWidget(field_combo)
+        layout.addWidget(QLabel("Value:"))
+        layout.addWidget(value_input)
+
+        buttons_layout = QHBoxLayout()
+        save_button = QPushButton("Save")
+        cancel_button = QPushButton("Cancel")
+        buttons_layout.addWidget(save_button)
+        buttons_layout.addWidget(cancel_button)
+        layout.addLayout(buttons_layout)
+
+        save_button.clicked.connect(lambda: self.update_records(dialog, table, record_ids, field_combo.currentText(), value_input.text()))
+        cancel_button.clicked.connect(dialog.reject)
+        dialog.exec()
+
+    #one prepared UPDATE run over all ids in a single transaction
+    def update_records(self, dialog, table, record_ids, field, text):
+        try:
+            value = parse_field_value(field, text)
+        except ValueError as error:
+            self.show_message("Input Error", f"Invalid {field}: {error}")
+            return
+        check = None
+        if table == "lendings" and field in AVAILABILITY_FIELDS:
+            check = lambda db: batch_conflict_message(db, record_ids)
+        updated, _, error = self.writes.update_many(table, record_ids, field, value, check)
+        if not updated:
+            if "would overlap" in error:
+                self.show_message("Car Unavailable", error)
+            else:
+                self.show_message("Edit Failed", f"Failed to edit {table}: {write_error_message(error)}")
+            return
+        if table == "lendings" and field == "lending_date":
+            self.request_graph(reload=True)
+        if table == "lendings":
+            self.lending_snapshot.invalidate()
+        dialog.accept()
+        self.models[table].update_records(record_ids)
+        self.forget_picker_results(table)
+
+    #a failed group commit rolled back writes the views already show
+    def on_commit_failed(self, error):
+        for model in self.models.values():
+            model.refresh()
+        self.lending_snapshot.invalidate()
+        if hasattr(self, "graph_tracker"):
+            self.request_graph(reload=True)
+        self.show_message("Save Failed", f"Recent changes could not be saved: {error}")
+
+    #helper for showing a simple message box
+    def show_message(self, title, text):
+        messagebox = QDialog(self)
+        messagebox.setWindowTitle(title)
+        layout = QVBoxLayout()
+        messagebox.setLayout(layout)
+        layout.addWidget(QLabel(text))
+        ok_button = QPushButton("OK")
+        ok_button.clicked.connect(messagebox.accept)
+        layout.addWidget(ok_button)
+        messagebox.exec()
+
+    #running a DatabaseTask behind a progress dialog, on_done gets the job's result
+    def run_db_task(self, title, job, on_done, profile=None):
+        self.writes.flush() #the task's own connection only sees committed writes
+        progress = QProgressDialog(title, None, 0, 0, self)
+        progress.setWindowTitle(title)
+        progress.setMinimumDuration(0)
+        task = DatabaseTask(job, profile, self)
+        task.progress.connect(progress.setLabelText)
+
+        def finish(result):
+            progress.close()
+            self.db_tasks.remove(task)
+            on_done(result)
+
+        task.finished_with.connect(finish)
+        self.db_tasks.append(task) #keeping a reference while the thread runs
+        task.start()
+        progress.show()
+
+    #importing a CSV/JSON Lines file into a table on a background connection
+    def import_file(self, table):
+        path, _ = QFileDialog.getOpenFileName(self, f"Import {table}", "", "Data files (*.csv *.jsonl *.ndjson *.json);;All files (*)")
+        if not path:
+            return
+
+        def done(summary):
             self.load_record_data(table)
+            self.forget_picker_results(table)
+            if summary.get("failed"):
+                self.show_message("Import Failed", f"Import stopped: {summary['failed']}\n{summary.get('imported', 0)} rows were committed before the failure.")
+                return
+            text = f"Imported {summary['imported']} rows in {summary['seconds']} s ({summary['rows_per_s']} rows/s)."
+            if summary["rejected"]:
+                text += f"\n{summary['rejected']} rows were rejected, e.g.:\n" + "\n".join(summary["errors"][:5])
+            self.show_message("Import Finished", text)
+
+        self.run_db_task(f"Importing {table}...", lambda db, report: import_records(db, table, path, report=report), done, "bulk_import")
+
+    #exporting a table or the graph aggregate on a background connection
+    def export_file(self, source):
+        path, _ = QFileDialog.getSaveFileName(self, f"Export {source}", f"{source}.csv", "CSV (*.csv);;JSON Lines (*.jsonl);;Parquet (*.parquet);;Arrow (*.arrow)")
+        if not path:
+            return
+
+        def done(summary):
+            if summary.get("failed"):
+                self.show_message("Export Failed", f"Export failed: {summary['failed']}")
+            else:
+                self.show_message("Export Finished", f"Exported {summary['rows']} rows in {summary['seconds']} s ({summary['rows_per_s']} rows/s).")
+
+        self.run_db_task(f"Exporting {source}...", lambda db, report: export_records(db, source, path, report=report), done)
+
+    #rejecting double-bookings: the car must not be lent for any day of the new period
+    def check_car_available(self, fields, values, record_id=None):
+        lending = dict(zip(fields, values))
+        conflicts = conflicting_lendings(self.db, lending["car_id"], lending["lending_date"], lending["return_date"], record_id)
+        if not conflicts:
+            return True
+        self.show_message("Car Unavailable", availability_message(lending["car_id"], conflicts))
+        return False
+
+    #dialog listing the cars not lent on any day of a period
+    def show_free_cars(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Free Cars")
+        layout = QVBoxLayout()
+        dialog.setLayout(layout)
+
+        from_input = QDateEdit()
+        from_input.setDisplayFormat(DATE_FORMAT)
+        from_input.setCalendarPopup(True)
+        from_input.setDate(QtCore.QDate.currentDate())
+        to_input = QDateEdit()
+        to_input.setDisplayFormat(DATE_FORMAT)
+        to_input.setCalendarPopup(True)
+        to_input.setDate(QtCore.QDate.currentDate().addDays(1))
+        summary_label = QLabel()
+        cars_list = QListWidget()
+
+        def update():
+            limit = 500
+            cars = free_cars(self.db, from_input.date().toString(DATE_FORMAT), to_input.date().toString(DATE_FORMAT), limit + 1)
+            cars_list.clear()
+            cars_list.addItems(f"{label} (#{car_id})" for car_id, label in cars[:limit])
+            summary_label.setText(f"More than {limit} free cars, showing the first {limit}" if len(cars) > limit else f"{len(cars)} free cars")
+
+        from_input.dateChanged.connect(update)
+        to_input.dateChanged.connect(update)
+        update()
+
+        layout.addWidget(QLabel("From:"))
+        layout.addWidget(from_input)
+        layout.addWidget(QLabel("Returned on:"))
+        layout.addWidget(to_input)
+        layout.addWidget(summary_label)
+        layout.addWidget(cars_list)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(dialog.accept)
+        layout.addWidget(close_button)
+        dialog.exec()
+
+    #analytics over the lending snapshot, which is brought up to date in the background first
+    def show_analytics(self):
+        version = data_version(self.db)
+        if version != self.snapshot_data_version:
+            self.lending_snapshot.invalidate() #another connection committed, maybe more than new lendings
+            self.snapshot_data_version = version
+        self.run_db_task("Reading Lendings", lambda db, report: self.lending_snapshot.refresh(db, report), self.open_analytics)
+
+    def open_analytics(self, result):
+        if isinstance(result, dict):
+            self.show_message("Analytics Failed", result["failed"])
+            return
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Lending Analytics")
+        layout = QVBoxLayout()
+        dialog.setLayout(layout)
+
+        from_input = QDateEdit()
+        from_input.setDisplayFormat(DATE_FORMAT)
+        from_input.setCalendarPopup(True)
+        from_input.setDate(QtCore.QDate.currentDate().addYears(-1))
+        to_input = QDateEdit()
+        to_input.setDisplayFormat(DATE_FORMAT)
+        to_input.setCalendarPopup(True)
+        to_input.setDate(QtCore.QDate.currentDate())
+        summary_label = QLabel()
+        weekdays_label = QLabel()
+        cars_list = QListWidget()
+        customers_list = QListWidget()
+        query = QSqlQuery("SELECT COUNT(*) FROM cars", self.db)
+        car_count = query.value(0) if query.next() else 0
+        query.finish() #an active query would hold a read snapshot while the dialog is open
+
+        def label(table, record_id):
+            query = QSqlQuery(self.db)
+            query.prepare(f"SELECT {PICKER_LABELS[table]} FROM {table} WHERE id = ?")
+            query.addBindValue(record_id)
+            return f"{query.value(0)} (#{record_id})" if query.exec() and query.next() else f"#{record_id} (deleted)"
+
+        def update():
+            first_day = from_input.date().toPyDate().toordinal()
+            last_day = to_input.date().toPyDate().toordinal()
+            if last_day < first_day:
+                summary_label.setText("The period ends before it starts")
+                return
+            start = time.perf_counter()
+            analytics = self.lending_snapshot.analytics(first_day, last_day, 10, car_count)
+            elapsed = (time.perf_counter() - start) * 1000
+            lines = [f"{analytics['lendings']} lendings by {analytics['customers']} customers started in the period"]
+            if analytics["mean_duration"] is not None:
+                lines.append(f"Average rental duration: {analytics['mean_duration']:.1f} days ({analytics['returned']} returned lendings)")
+            if analytics["fleet_utilization"] is not None:
+                lines.append(f"Fleet utilization: {analytics['fleet_utilization']:.1%} of {car_count} cars")
+            lines.append(f"Computed over {self.lending_snapshot.size} lendings in {elapsed:.1f} ms")
+            summary_label.setText("\n".join(lines))
+            busiest = sorted(range(7), key=lambda day: -analytics["weekdays"][day])
+            weekdays_label.setText("Busiest weekdays: " + ", ".join(f"{WEEKDAYS[day]} ({analytics['weekdays'][day]})" for day in busiest))
+            cars_list.clear()
+            cars_list.addItems(f"{label('cars', car_id)}: {days} days lent, {share:.0%}" for car_id, days, share in analytics["busiest_cars"])
+            customers_list.clear()
+            customers_list.addItems(f"{label('customers', customer_id)}: {lendings} lendings" for customer_id, lendings in analytics["frequent_customers"])
+
+        from_input.dateChanged.connect(update)
+        to_input.dateChanged.connect(update)
+        update()
+
+        layout.addWidget(QLabel("From:"))
+        layout.addWidget(from_input)
+        layout.addWidget(QLabel("To:"))
+        layout.addWidget(to_input)
+        layout.addWidget(summary_label)
+        layout.addWidget(weekdays_label)
+        layout.addWidget(QLabel("Most used cars:"))
+        layout.addWidget(cars_list)
+        layout.addWidget(QLabel("Most frequent customers:"))
+        layout.addWidget(customers_list)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(dialog.accept)
+        layout.addWidget(close_button)
+        dialog.exec()
+
+    #helper for looking up the current lending date of a record
+    def get_lending_date(self, record_id):
+        query = QSqlQuery()
+        query.prepare("SELECT lending_date FROM lendings WHERE id = ?")
+        query.addBindValue(record_id)
+        if query.exec() and query.next():
+            return query.value(0)
+        return None
 
     #----------------------------------------------------------------------------------
 
-    #helper forfetching graph data
+    #helper for fetching graph data, served from the in-memory aggregate
     def update_graph_data(self):
-        query = QSqlQuery("SELECT lending_date, COUNT(*) as count FROM lendings GROUP BY lending_date")
-        dates = []
-        counts = []
-        while query.next():
-            dates.append(query.value(0))
-            counts.append(query.value(1))
-        return dates, counts
+        with METRICS.timer("graph.series"):
+            return chart_series(self.graph_tracker.counts, *self.graph_options())
+
+    #chart_series arguments for the current controls and canvas size
+    def graph_options(self):
+        return (self.graph_type_combo.currentText(), self.graph_bucket_combo.currentText(), self.canvas.width(), self.pie_top_spin.value())
 
     #refreshing the graph display
     def refresh_graph(self):
-        self.show_lending_graph(self.graph_type_combo.currentText())
+        self.request_graph()
+
+    #posting a graph job to the worker, superseding any job still queued
+    def request_graph(self, reload=False):
+        if reload:
+            self.writes.flush() #the worker reloads on its own connection
+        self.graph_generation += 1
+        self.graph_request_version = self.graph_tracker.version
+        if reload:
+            self.graph_reload_version = self.graph_tracker.version
+        self.graph_worker.request(self.graph_generation, self.graph_tracker.counts, self.graph_options(), reload)
+
+    def on_graph_result(self, generation, reloaded, series):
+        if reloaded is not None:
+            if self.graph_tracker.version == self.graph_reload_version:
+                self.graph_tracker.replace(reloaded)
+                self.graph_request_version = self.graph_tracker.version
+            else:
+                #a local write landed while reloading, the snapshot may miss it
+                self.request_graph(reload=True)
+                return
+        if generation != self.graph_generation:
+            return #a newer request is already on its way
+        self.show_lending_graph(self.graph_type_combo.currentText(), series)
+
+    #timer tick: only redrawing when the aggregate actually changed
+    def on_graph_timer(self):
+        if self.graph_tracker.external_change():
+            self.request_graph(reload=True)
+            return
+        if not self.graph_tracker.is_dirty():
+            self.graph_tracker.skipped_ticks += 1
+            METRICS.increment("graph.skipped_ticks")
+            return
+        self.refresh_graph()
+
+    #an automatic bucket depends on the canvas width
+    def on_canvas_resize(self, event):
+        if self.graph_bucket_combo.currentText() == "Auto" and self.graph_artists is not None:
+            self.refresh_graph()
+
+    def closeEvent(self, event):
+        self.writes.flush()
+        if hasattr(self, "graph_worker"):
+            self.graph_timer.stop()
+            self.graph_worker.stop()
+        if METRICS_FILE:
+            self.dump_metrics()
+        super().closeEvent(event)
+
+    #debug overlay (F12) with the slowest operations, and the periodic metrics dump
+    def init_metrics(self):
+        self.metrics_overlay = QLabel(self)
+        self.metrics_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 190); color: #9fe89f; font-family: monospace; font-size: 11px; padding: 6px; border-radius: 6px;")
+        self.metrics_overlay.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.metrics_overlay.hide()
+        self.metrics_overlay_timer = QTimer(self)
+        self.metrics_overlay_timer.setInterval(1000)
+        self.metrics_overlay_timer.timeout.connect(self.update_metrics_overlay)
+        QShortcut(QKeySequence("F12"), self).activated.connect(self.toggle_metrics_overlay)
+
+        if METRICS_FILE:
+            self.metrics_dump_timer = QTimer(self)
+            self.metrics_dump_timer.setInterval(10000)
+            self.metrics_dump_timer.timeout.connect(self.dump_metrics)
+            self.metrics_dump_timer.start()
+
+    def toggle_metrics_overlay(self):
+        if self.metrics_overlay.isVisible():
+            self.metrics_overlay_timer.stop()
+            self.metrics_overlay.hide()
+        else:
+            self.update_metrics_overlay()
+            self.metrics_overlay.show()
+            self.metrics_overlay.raise_()
+            self.metrics_overlay_timer.start()
+
+    def update_metrics_overlay(self):
+        self.metrics_overlay.setText("\n".join(METRICS.summary_lines()) or "no metrics yet")
+        self.metrics_overlay.adjustSize()
+        self.metrics_overlay.move(self.width() - self.metrics_overlay.width() - 10, 10)
+
+    def dump_metrics(self):
+        try:
+            METRICS.dump(METRICS_FILE)
+        except OSError as error:
+            print("Failed to write metrics:", error)
 
     def _generate_color_tints(self, base_color, n):
         """Return n RGB tuples (0-1) as tints of base_color."""
+        from matplotlib import colors as mcolors
         try:
             rgb = mcolors.to_rgb(base_color)
         except Exception:
@@ -869,73 +3412,405 @@ class CarLendingApp(QWidget):
 
 
     #method for showing lending graph
-    def show_lending_graph(self, graph_type):
-        #fetching data
-        dates, counts = self.update_graph_data()
+    def show_lending_graph(self, graph_type, series=None):
+        #fetching data, unless the worker already computed it
+        if series is None:
+            series = self.update_graph_data()
+            self.graph_request_version = self.graph_tracker.version
+        bucket, dates, counts = series
+        self.graph_tracker.drawn_version = self.graph_request_version
+        self.graph_series = series
+
+        #getting custom title or using default
+        custom_title = self.title_input.text().strip() if hasattr(self, 'title_input') else ""
+
+        #determining selected color
+        sel_color = None
+        if hasattr(self, 'color_combo'):
+            sel_color = self.color_combo.currentText()
+        if not sel_color:
+            sel_color = 'tab:blue'
 
-        #clearing axes and redraw
+        if not dates or sum(counts) == 0:
+            graph_type = None #"no data" placeholder
+            dates = []
+        title = custom_title if custom_title else GRAPH_TITLES.get(graph_type, "Lendings")
+
+        #artists are only rebuilt when the chart type or the categories change
+        key = (graph_type, tuple(dates), bucket)
+        if self.graph_artists is None or self.graph_artists["key"] != key or not self.update_lending_graph(counts, sel_color, title):
+            self.build_lending_graph(key, dates, counts, sel_color, title)
+
+    #re-applying title and color to the chart currently shown
+    def restyle_graph(self):
+        if self.graph_artists is None:
+            self.refresh_graph()
+        else:
+            self.show_lending_graph(self.graph_type_combo.currentText(), self.graph_series)
+
+    #full rebuild of the axes, used when the chart type or the categories change
+    def build_lending_graph(self, key, dates, counts, sel_color, title):
+        from matplotlib.dates import DateFormatter
+        from matplotlib.ticker import MaxNLocator
+        start = time.perf_counter()
+        graph_type = key[0]
+
+        #clearing axes and redraw; clear() keeps the equal aspect a pie chart sets
         self.ax.clear()
-        #ensuring axes use dark background and light text on each redraw
+        self.ax.set_aspect('auto')
+        #ensuring axes use dark background and light text on each rebuild
         self.ax.set_facecolor('#1e1e1e')
         self.ax.tick_params(colors='#d4d7db', which='both')
         self.ax.xaxis.label.set_color('#d4d7db')
         self.ax.yaxis.label.set_color('#d4d7db')
         self.ax.title.set_color('#e0e0e0')
 
-        #getting custom title or using default
-        custom_title = self.title_input.text().strip() if hasattr(self, 'title_input') else ""
-
-        if not dates or sum(counts) == 0:
+        artists = []
+        if graph_type is None:
             self.ax.text(0.5, 0.5, "No lending data available", ha='center', va='center')
-            if custom_title:
-                self.ax.set_title(custom_title)
-            else:
-                self.ax.set_title("Lendings")
-        else:
-            #determining selected color
-            sel_color = None
-            if hasattr(self, 'color_combo'):
-                sel_color = self.color_combo.currentText()
-            if not sel_color:
-                sel_color = 'tab:blue'
-
+        elif graph_type == "Bar Chart":
+            artists = list(self.ax.bar(dates, counts, color=sel_color))
+            #one label per bar would overlap, showing a readable subset
+            self.ax.xaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
+            self.ax.set_xlabel(BUCKET_LABELS[key[2]])
+            self.ax.set_ylabel("Number of Lendings")
+        elif graph_type == "Pie Chart":
+            try:
+                colors = self._generate_color_tints(sel_color, len(counts))
+            except Exception:
+                colors = [sel_color for _ in counts]
+            #using textprops so labels and percents are light on dark bg
+            wedges, _, _ = self.ax.pie(counts, labels=dates, autopct='%1.1f%%', startangle=140, colors=colors, textprops={'color':'#e0e0e0'})
+            artists = list(wedges)
+        elif graph_type == "Line Graph":
+            #down-sampled points are unevenly spaced, so they go on a real date axis
+            try:
+                xs = [datetime.date.fromisoformat(date) for date in dates]
+            except (TypeError, ValueError):
+                xs = dates
+            artists = self.ax.plot(xs, counts, marker='o' if len(dates) <= 100 else None, linestyle='-', color=sel_color)
+            #date axis values are days; on short ranges integer ticks keep it from showing hours
+            if xs is dates or (xs[-1] - xs[0]).days < 7:
+                self.ax.xaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
+                if xs is not dates:
+                    self.ax.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d"))
+            self.ax.set_xlabel(BUCKET_LABELS[key[2]])
+            self.ax.set_ylabel("Number of Lendings")
+        self.ax.set_title(title)
+
+        #title and data artists are animated so they can be blitted over a cached background
+        self.ax.title.set_animated(True)
+        for artist in artists:
+            artist.set_animated(True)
+        self.graph_artists = {"key": key, "artists": artists, "counts": list(counts), "color": sel_color}
+        METRICS.record("graph.build_artists", time.perf_counter() - start, len(dates))
+
+        with METRICS.timer("graph.tight_layout"):
+            try:
+                self.fig.tight_layout()
+            except Exception:
+                pass
+        with METRICS.timer("graph.draw"):
+            self.canvas.draw()
+
+    def update_lending_graph(self, counts, sel_color, title):
+        """Update the existing artists in place, returns False if a rebuild is needed."""
+        graph = self.graph_artists
+        graph_type = graph["key"][0]
+        counts = list(counts)
+        relayout = False
+        start = time.perf_counter()
+
+        if counts != graph["counts"]:
             if graph_type == "Bar Chart":
-                bars = self.ax.bar(dates, counts, color=sel_color)
-                title = custom_title if custom_title else "Lendings per Date - Bar Chart"
-                self.ax.set_title(title)
-                self.ax.set_xlabel("Date")
-                self.ax.set_ylabel("Number of Lendings")
-                #ensuring tick and label colors are readable on dark background
-                self.ax.tick_params(axis='x', colors='#d4d7db')
-                self.ax.tick_params(axis='y', colors='#d4d7db')
-                self.ax.xaxis.label.set_color('#d4d7db')
-                self.ax.yaxis.label.set_color('#d4d7db')
-            elif graph_type == "Pie Chart":
+                for bar, count in zip(graph["artists"], counts):
+                    bar.set_height(count)
+            elif graph_type == "Line Graph":
+                graph["artists"][0].set_ydata(counts)
+            else:
+                return False #pie wedge angles depend on every count
+            #rescaling only when the new values don't fit the current limits
+            low, high = self.ax.get_ylim()
+            if max(counts) > high or max(counts) < high / 2:
+                self.ax.relim()
+                self.ax.autoscale_view()
+                relayout = True
+            graph["counts"] = counts
+
+        if sel_color != graph["color"]:
+            if graph_type == "Pie Chart":
                 try:
                     colors = self._generate_color_tints(sel_color, len(counts))
                 except Exception:
                     colors = [sel_color for _ in counts]
-                #using textprops so labels and percents are light on dark bg
-                self.ax.pie(counts, labels=dates, autopct='%1.1f%%', startangle=140, colors=colors, textprops={'color':'#e0e0e0'})
-                title = custom_title if custom_title else "Lendings Distribution - Pie Chart"
-                self.ax.set_title(title)
-            elif graph_type == "Line Graph":
-                self.ax.plot(dates, counts, marker='o', linestyle='-', color=sel_color)
-                title = custom_title if custom_title else "Lendings per Date - Line Graph"
-                self.ax.set_title(title)
-                self.ax.set_xlabel("Date")
-                self.ax.set_ylabel("Number of Lendings")
-                self.ax.tick_params(axis='x', colors='#d4d7db')
-                self.ax.tick_params(axis='y', colors='#d4d7db')
+                for wedge, color in zip(graph["artists"], colors):
+                    wedge.set_facecolor(color)
+            else:
+                for artist in graph["artists"]:
+                    artist.set_color(sel_color)
+            graph["color"] = sel_color
 
-        try:
-            self.fig.tight_layout()
-        except Exception:
-            pass
-        self.canvas.draw()     
+        self.ax.set_title(title)
+        METRICS.record("graph.update_artists", time.perf_counter() - start, len(counts))
+
+        if relayout or self.graph_background is None:
+            with METRICS.timer("graph.draw"):
+                self.canvas.draw()
+        else:
+            with METRICS.timer("graph.blit"):
+                self.blit_graph()
+        return True
+
+    #draw_event hook: caching the static background and painting the animated artists
+    def on_canvas_draw(self, event):
+        self.graph_background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_graph_artists()
+
+    def draw_graph_artists(self):
+        if self.graph_artists is None:
+            return
+        for artist in self.graph_artists["artists"]:
+            self.ax.draw_artist(artist)
+        self.ax.draw_artist(self.ax.title)
+
+    def blit_graph(self):
+        self.canvas.restore_region(self.graph_background)
+        self.draw_graph_artists()
+        self.canvas.blit(self.fig.bbox)
+
+#what can be exported: the three tables and the per-date/week/month lending counts
+EXPORT_QUERIES = {
+    "customers": "SELECT * FROM customers ORDER BY id",
+    "cars": "SELECT * FROM cars ORDER BY id",
+    "lendings": "SELECT * FROM lendings ORDER BY id",
+    "all_lendings": "SELECT * FROM all_lendings ORDER BY id", #archived ones included
+    "lending_counts": "SELECT lending_date, lendings FROM lending_daily_counts ORDER BY lending_date",
+    "lending_weekly_counts": "SELECT week_start, lendings FROM lending_weekly_counts ORDER BY week_start",
+    "lending_monthly_counts": "SELECT month_start, lendings FROM lending_monthly_counts ORDER BY month_start",
+}
+
+#pyarrow type of a result column by the Qt type the driver reports for its declared type,
+#columns of any other type are exported as strings
+ARROW_TYPES = {
+    "int": "int64",
+    "uint": "int64",
+    "qlonglong": "int64",
+    "qulonglong": "int64",
+    "double": "float64",
+    "bool": "bool_",
+    "QByteArray": "binary",
+}
+
+class RecordWriter:
+    """Writes chunks of rows to a CSV, JSON Lines, Parquet or Arrow file."""
+
+    def __init__(self, path, fmt, columns, types=None):
+        self.path = path
+        self.fmt = fmt
+        self.columns = columns
+        self.file = None
+        self.arrow_writer = None
+        self.schema = None
+        if fmt in ("parquet", "arrow"):
+            try:
+                import pyarrow
+            except ImportError:
+                raise RuntimeError(f"Exporting {fmt} files needs pyarrow, which is not installed")
+            self.pyarrow = pyarrow
+            #an explicit schema, inferring it from the first chunk types an all-NULL column as null
+            self.schema = pyarrow.schema([(column, getattr(pyarrow, arrow_type)()) for column, arrow_type in zip(columns, types or ["string"] * len(columns))])
+        elif fmt in ("csv", "jsonl"):
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            if fmt == "csv":
+                self.csv_writer = csv.writer(self.file)
+                self.csv_writer.writerow(columns)
+        else:
+            raise RuntimeError(f"Unknown export format {fmt}")
+
+    def write(self, rows):
+        if self.fmt == "csv":
+            self.csv_writer.writerows(rows)
+        elif self.fmt == "jsonl":
+            self.file.writelines(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows)
+        else:
+            data = {column: [row[i] for row in rows] for i, column in enumerate(self.columns)}
+            table = self.pyarrow.Table.from_pydict(data, schema=self.schema)
+            if self.arrow_writer is None:
+                if self.fmt == "parquet":
+                    import pyarrow.parquet
+                    self.arrow_writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+                else:
+                    import pyarrow.ipc
+                    self.arrow_writer = pyarrow.ipc.new_file(self.path, self.schema)
+            self.arrow_writer.write_table(table)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+
+def export_records(db, source, path, fmt=None, chunk_size=10000, report=print):
+    """Stream a table or the graph aggregate to a file.
+
+    Rows come from a forward-only cursor and are written chunk_size at a time,
+    so memory stays constant however many rows are exported. Returns a summary dict.
+    """
+    fmt = file_format(path, fmt)
+    query = QSqlQuery(db)
+    query.setForwardOnly(True)
+    if not query.exec(EXPORT_QUERIES[source]):
+        raise RuntimeError(query.lastError().text())
+    record = query.record()
+    columns = [record.fieldName(i) for i in range(record.count())]
+    types = [ARROW_TYPES.get((record.field(i).metaType().name() or b"").decode(), "string") for i in range(record.count())]
+
+    start = time.perf_counter()
+    exported = 0
+    writer = RecordWriter(path, fmt, columns, types)
+    try:
+        chunk = []
+        while query.next():
+            chunk.append(tuple(None if query.isNull(i) else query.value(i) for i in range(len(columns))))
+            if len(chunk) >= chunk_size:
+                writer.write(chunk)
+                exported += len(chunk)
+                chunk = []
+                report(f"{source}: {exported} rows exported")
+        if chunk or (exported == 0 and fmt in ("parquet", "arrow")):
+            writer.write(chunk)
+            exported += len(chunk)
+    finally:
+        writer.close()
+
+    seconds = round(time.perf_counter() - start, 3)
+    METRICS.record(f"export.{source}", time.perf_counter() - start, exported)
+    summary = {"source": source, "path": path, "rows": exported, "seconds": seconds, "rows_per_s": round(exported / seconds, 1) if seconds else 0.0, "failed": None}
+    report(f"{source}: {exported} rows exported to {path} in {seconds} s ({summary['rows_per_s']} rows/s)")
+    return summary
+
+#command line tools, running without the GUI
+def run_import(args):
+    db = open_connection(profile="bulk_import")
+    if db is None:
+        print("Unable to open database")
+        return 1
+    create_schema(db)
+    migrate_db(db)
+    summary = import_records(db, args.table, args.file, args.format, args.chunk_size)
+    for error in summary["errors"]:
+        print("  rejected", error)
+    return 1 if summary["failed"] else 0
+
+def run_export(args):
+    db = open_connection()
+    if db is None:
+        print("Unable to open database")
+        return 1
+    try:
+        export_records(db, args.source, args.file, args.format, args.chunk_size)
+    except RuntimeError as error:
+        print("Export failed:", error)
+        return 1
+    return 0
+
+def run_rebuild_rollups(args):
+    db = open_connection()
+    if db is None:
+        print("Unable to open database")
+        return 1
+    create_schema(db)
+    migrate_db(db)
+    days = rebuild_lending_rollup(db)
+    if days is None:
+        return 1
+    print(f"Lending counts rebuilt: {days} days")
+    return 0
+
+def run_archive(args):
+    try:
+        before = datetime.date.fromisoformat(args.before) if args.before else datetime.date.today() - datetime.timedelta(days=args.days)
+    except ValueError:
+        print(f"Invalid date {args.before!r}, expected yyyy-mm-dd")
+        return 1
+    db = open_connection(profile="bulk_import")
+    if db is None:
+        print("Unable to open database")
+        return 1
+    create_schema(db)
+    migrate_db(db)
+    archived = archive_lendings(db, before.isoformat(), args.dry_run, args.batch_size)
+    if archived is None:
+        return 1
+    if args.vacuum and archived and not args.dry_run:
+        #the freed pages are reused by new lendings anyway, VACUUM gives them back to the file system
+        start = time.perf_counter()
+        query = QSqlQuery(db)
+        if not query.exec("VACUUM main"):
+            print("VACUUM failed:", query.lastError().text())
+            return 1
+        print(f"{db.databaseName()} compacted in {time.perf_counter() - start:.1f} s")
+    return 0
+
+def run_repair_orphans(args):
+    db = open_connection()
+    if db is None:
+        print("Unable to open database")
+        return 1
+    create_schema(db)
+    migrate_db(db)
+    return 1 if repair_orphans(db, args.dry_run) is None else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Car Lending Management System, starts the GUI when no command is given")
+    commands = parser.add_subparsers(dest="command")
+
+    import_parser = commands.add_parser("import", help="bulk import a CSV or JSON Lines file")
+    import_parser.add_argument("table", choices=list(IMPORT_COLUMNS))
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="file format, guessed from the extension by default")
+    import_parser.add_argument("--chunk-size", type=int, default=5000, help="rows per batched insert")
+    import_parser.set_defaults(run=run_import)
+
+    export_parser = commands.add_parser("export", help="export a table or the daily/weekly/monthly lending counts")
+    export_parser.add_argument("source", choices=list(EXPORT_QUERIES))
+    export_parser.add_argument("file")
+    export_parser.add_argument("--format", choices=["csv", "jsonl", "parquet", "arrow"], help="file format, guessed from the extension by default")
+    export_parser.add_argument("--chunk-size", type=int, default=10000, help="rows read and written at a time")
+    export_parser.set_defaults(run=run_export)
+
+    rebuild_parser = commands.add_parser("rebuild-rollups", help="recount the per-day lending counts the graph reads")
+    rebuild_parser.set_defaults(run=run_rebuild_rollups)
+
+    archive_parser = commands.add_parser("archive", help="move lendings returned long ago to the archive db next to the lending db")
+    archive_parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive lendings returned more than this many days ago (default: %(default)s, $CAR_LENDING_ARCHIVE_DAYS)")
+    archive_parser.add_argument("--before", metavar="DATE", help="archive lendings returned before this date (yyyy-mm-dd) instead")
+    archive_parser.add_argument("--batch-size", type=int, default=5000, help="lendings moved per transaction")
+    archive_parser.add_argument("--dry-run", action="store_true", help="only count the lendings to archive")
+    archive_parser.add_argument("--vacuum", action="store_true", help="compact the lending db afterwards")
+    archive_parser.set_defaults(run=run_archive)
+
+    repair_parser = commands.add_parser("repair-orphans", help="delete lendings whose customer or car no longer exists")
+    repair_parser.add_argument("--dry-run", action="store_true", help="only count the orphaned lendings")
+    repair_parser.set_defaults(run=run_repair_orphans)
+
+    parser.add_argument("--service", metavar="URL", help="send the GUI's writes to a running lending_service.py (default: $CAR_LENDING_SERVICE_URL)")
+
+    #unknown arguments are left for Qt (-style, -platform, ...) when starting the GUI
+    args, unknown = parser.parse_known_args(argv)
+    if args.command is not None and unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    if args.command is None:
+        app = QApplication(sys.argv)
+        window = CarLendingApp(args.service)
+        window.show()
+        return app.exec()
+
+    app = QtCore.QCoreApplication(sys.argv[:1])
+    status = args.run(args)
+    if METRICS_FILE:
+        METRICS.dump(METRICS_FILE)
+    return status
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = CarLendingApp()
-    window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,479 @@
+"""HTTP/JSON service over the car lending database, for terminals that should not open the db file themselves.
+
+    python lending_service.py [--host HOST] [--port PORT] [--readers N] [--db FILE]
+
+Routes, with JSON request and response bodies (tables are customers, cars and lendings):
+
+    GET    /<table>?after=ID&limit=N       a page of rows ordered by id, "next" is the after= of the
+                                           following page; customers and cars take q=TEXT (search),
+                                           lendings customer_id=, car_id=, from= and to= (lending date)
+    GET    /<table>/<id>                   one row
+    POST   /<table>                        insert, every column is required, answers {"id": ...}
+    PATCH  /<table>/<id>                   update the given columns
+    DELETE /<table>/<id>                   delete, 409 if a delete rule refuses it
+    PATCH  /<table>  {"ids": [...], "changes": {...}}   the same update on several rows, all or nothing
+    DELETE /<table>  {"ids": [...]}                     delete several rows, all or nothing
+    GET    /graph?bucket=Day|Week|Month    lendings per date, the aggregate behind update_graph_data()
+
+GET answers carry an ETag made from PRAGMA data_version, which changes whenever any
+connection (this service's writer, a GUI, an import) commits. A GET whose If-None-Match
+still matches is answered 304 without reading the tables, and the encoded answers of the
+latest GETs are kept per (target, ETag), so clients asking the same thing between two
+commits (the graph, mostly) share one read.
+
+The db is reached through one writer and --readers reader connections in WAL mode, so
+reads never wait for writes. QtSql connections may only be used by the thread that opened
+them, so each one is owned by a single-thread executor. Writes are queued and the writer
+runs everything queued since its last commit as one transaction (a savepoint per request,
+so a failing request only undoes itself): concurrent clients share commits.
+"""
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from PyQt6.QtCore import QCoreApplication
+from PyQt6.QtSql import QSqlDatabase, QSqlQuery
+
+import car_lending
+from car_lending import METRICS
+
+TABLES = car_lending.IMPORT_COLUMNS #writable columns per table
+PAGE_LIMIT = 100 #rows per page unless limit= says otherwise
+MAX_PAGE_LIMIT = 1000
+MAX_GROUP = 500 #queued writes committed together at most
+CACHED_RESPONSES = 256 #encoded GET answers kept, least recently used dropped first
+LENDING_FILTERS = {
+    "customer_id": "customer_id = ?",
+    "car_id": "car_id = ?",
+    "from": "lending_date >= ?",
+    "to": "lending_date <= ?",
+}
+REASONS = {200: "OK", 201: "Created", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class ApiError(Exception):
+    """A request that can't be served, answered with status and {"error": message}."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Connection:
+    """A QtSql connection owned by a thread of its own, with its prepared statements."""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.statements = {} #sql -> prepared QSqlQuery
+        self.db = self.executor.submit(car_lending.open_connection, name, path).result()
+        if self.db is None:
+            raise RuntimeError(f"Unable to open {path}")
+
+    #runs function(connection, *args) on the owning thread
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, self, *args)
+
+    def execute(self, sql, values=()):
+        """Run a statement, raises ApiError if it fails."""
+        query = self.statements.get(sql)
+        if query is None:
+            query = QSqlQuery(self.db)
+            query.prepare(sql)
+            self.statements[sql] = query
+        for position, value in enumerate(values):
+            query.bindValue(position, value)
+        if not query.exec():
+            error = query.lastError().databaseText()
+            #constraint errors, delete rules included, are the client's to resolve
+            raise ApiError(409 if "constraint failed" in error or "still referenced" in error else 500, error)
+        return query
+
+    def rows(self, sql, values=()):
+        query = self.execute(sql, values)
+        width = query.record().count()
+        rows = []
+        while query.next():
+            rows.append(tuple(None if query.isNull(i) else query.value(i) for i in range(width)))
+        query.finish() #ending the read transaction, a kept statement would pin the reader's snapshot
+        return rows
+
+    def close(self):
+        def close(connection):
+            connection.statements.clear()
+            connection.db.close()
+            connection.db = None
+            QSqlDatabase.removeDatabase(connection.name)
+        self.executor.submit(close, self).result()
+        self.executor.shutdown()
+
+class ConnectionPool:
+    """One writer and a few readers; writes queued while the writer is busy share its next commit."""
+
+    def __init__(self, path, readers):
+        self.writer = Connection("service_writer", path)
+        self.readers = [Connection(f"service_reader_{i}", path) for i in range(readers)]
+        self.idle = asyncio.Queue()
+        for reader in self.readers:
+            self.idle.put_nowait(reader)
+        #only ever asked for data_version, from the event loop thread
+        self.monitor = car_lending.open_connection("service_monitor", path)
+        self.pending = [] #(function, args, future) waiting for the writer
+        self.drain_task = None
+
+    def data_version(self):
+        query = QSqlQuery("PRAGMA data_version", self.monitor)
+        return query.value(0) if query.next() else 0
+
+    async def read(self, function, *args):
+        reader = await self.idle.get()
+        try:
+            return await reader.run(function, *args)
+        finally:
+            self.idle.put_nowait(reader)
+
+    async def write(self, function, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((function, args, future))
+        if self.drain_task is None:
+            self.drain_task = asyncio.create_task(self.drain())
+        return await future
+
+    async def drain(self):
+        try:
+            while self.pending:
+                group, self.pending = self.pending[:MAX_GROUP], self.pending[MAX_GROUP:]
+                results = await self.writer.run(run_group, [(function, args) for function, args, _ in group])
+                for (_, _, future), (ok, value) in zip(group, results):
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+        finally:
+            self.drain_task = None
+
+    def close(self):
+        for connection in [self.writer] + self.readers:
+            connection.close()
+        self.monitor.close()
+        self.monitor = None
+        QSqlDatabase.removeDatabase("service_monitor")
+
+def run_group(connection, jobs):
+    """Run write jobs in one transaction, each in a savepoint. Returns (ok, result or ApiError) per job."""
+    db = connection.db
+    query = QSqlQuery(db)
+    with METRICS.timer("service.group_commit") as sample:
+        sample["rows"] = len(jobs)
+        if not db.transaction():
+            return [(False, ApiError(503, db.lastError().text()))] * len(jobs)
+        results = []
+        for function, args in jobs:
+            query.exec("SAVEPOINT request")
+            try:
+                results.append((True, function(connection, *args)))
+                query.exec("RELEASE request")
+            except Exception as error:
+                query.exec("ROLLBACK TO request")
+                query.exec("RELEASE request")
+                if not isinstance(error, ApiError):
+                    print("Write failed:", repr(error))
+                    error = ApiError(500, str(error))
+                #the traceback would keep this thread's queries, and so the connection, alive
+                results.append((False, error.with_traceback(None)))
+        if not db.commit():
+            error = ApiError(503, f"Commit failed: {db.lastError().text()}")
+            db.rollback()
+            return [(False, error)] * len(jobs)
+    return results
+
+def parse_record(table, body, partial=False):
+    """Column values of a JSON record, converted like imported ones; raises ApiError if invalid."""
+    if not isinstance(body, dict):
+        raise ApiError(400, "expected a JSON object")
+    columns = TABLES[table]
+    unknown = sorted(set(body) - set(columns))
+    if unknown:
+        raise ApiError(400, f"unknown fields: {', '.join(unknown)}")
+    missing = [column for column in columns if column not in body]
+    if missing and not partial:
+        raise ApiError(400, f"missing fields: {', '.join(missing)}")
+    if not body:
+        raise ApiError(400, "nothing to change")
+    flags = sorted(column for column in body if isinstance(body[column], bool))
+    if flags:
+        raise ApiError(400, f"expected a number or text, not true/false: {', '.join(flags)}")
+    try:
+        return {column: car_lending.parse_field_value(column, body[column]) for column in columns if column in body}
+    except (TypeError, ValueError) as error:
+        raise ApiError(400, str(error))
+
+def parse_ids(body):
+    ids = body.get("ids") if isinstance(body, dict) else None
+    #bool is an int subclass, {"ids": [true]} must not mean lending #1
+    if not isinstance(ids, list) or not ids or not all(type(record_id) is int for record_id in ids):
+        raise ApiError(400, "expected a non-empty list of integer ids")
+    return ids
+
+def parse_page(table, params):
+    """(after, limit, search text, conditions, values) of a page request; raises ApiError if invalid."""
+    try:
+        after = int(params.get("after", 0))
+        limit = max(1, min(int(params.get("limit", PAGE_LIMIT)), MAX_PAGE_LIMIT))
+        conditions, values = [], []
+        search = params.get("q", "") if table in car_lending.SEARCH_COLUMNS else ""
+        if table == "lendings":
+            for name, condition in LENDING_FILTERS.items():
+                if name in params:
+                    column = "lending_date" if name in ("from", "to") else name
+                    conditions.append(condition)
+                    values.append(car_lending.parse_field_value(column, params[name]))
+    except ValueError as error:
+        raise ApiError(400, str(error))
+    return after, limit, search, conditions, values
+
+#reads, run on a reader connection
+def list_rows(connection, table, after, limit, search, conditions, values):
+    columns = ["id"] + TABLES[table]
+    condition, search_values = car_lending.search_condition(connection.db, table, search)
+    if condition:
+        conditions, values = conditions + [f"({condition})"], values + search_values
+    where = " AND ".join(["id > ?"] + conditions)
+    rows = connection.rows(f"SELECT {', '.join(columns)} FROM {table} WHERE {where} ORDER BY id LIMIT ?", [after] + values + [limit])
+    return {"rows": [dict(zip(columns, row)) for row in rows], "next": rows[-1][0] if len(rows) == limit else None}
+
+def get_row(connection, table, record_id):
+    columns = ["id"] + TABLES[table]
+    rows = connection.rows(f"SELECT {', '.join(columns)} FROM {table} WHERE id = ?", [record_id])
+    if not rows:
+        raise ApiError(404, f"no {table} record {record_id}")
+    return dict(zip(columns, rows[0]))
+
+def lending_graph(connection, bucket):
+    counts = car_lending.bucket_counts(car_lending.query_lending_counts(connection.db), bucket)
+    return {"bucket": bucket, "counts": counts}
+
+#writes, run by the writer inside a group
+def insert_row(connection, table, record):
+    if table == "lendings":
+        conflicts = car_lending.conflicting_lendings(connection.db, record["car_id"], record["lending_date"], record["return_date"])
+        if conflicts:
+            raise ApiError(409, car_lending.availability_message(record["car_id"], conflicts))
+    columns = list(record)
+    query = connection.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", list(record.values()))
+    return {"id": query.lastInsertId()}
+
+def update_rows(connection, table, record_ids, changes, single=False):
+    columns = list(changes)
+    sql = f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?"
+    updated = 0
+    for record_id in record_ids:
+        updated += connection.execute(sql, list(changes.values()) + [record_id]).numRowsAffected()
+    if single and not updated:
+        raise ApiError(404, f"no {table} record {record_ids[0]}")
+    #checked after writing, so the edited lendings are also checked against each other
+    if table == "lendings" and set(columns) & set(car_lending.AVAILABILITY_FIELDS):
+        error = car_lending.batch_conflict_message(connection.db, record_ids)
+        if error:
+            raise ApiError(409, error)
+    return {"updated": updated}
+
+def delete_rows(connection, table, record_ids, single=False):
+    sql = f"DELETE FROM {table} WHERE id = ?"
+    deleted = 0
+    for record_id in record_ids:
+        deleted += connection.execute(sql, [record_id]).numRowsAffected()
+    if single and not deleted:
+        raise ApiError(404, f"no {table} record {record_ids[0]}")
+    return {"deleted": deleted}
+
+class LendingService:
+    """Routes HTTP requests to the pool, speaking just enough HTTP/1.1 (keep-alive, Content-Length bodies)."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.instance = format(int(time.time() * 1000), "x") #data_version restarts with the connection
+        self.clients = {} #stream writer -> task serving it
+        self.responses = OrderedDict() #(target, etag) -> encoded body
+
+    def etag(self):
+        return f'"{self.instance}-{self.pool.data_version()}"'
+
+    async def conditional(self, target, headers, function, *args):
+        etag = self.etag()
+        if etag in headers.get("if-none-match", ""):
+            METRICS.increment("service.not_modified")
+            return 304, None, {"ETag": etag}
+        key = (target, etag)
+        body = self.responses.get(key)
+        if body is None:
+            body = json.dumps(await self.pool.read(function, *args)).encode("utf-8")
+            self.responses[key] = body
+            if len(self.responses) > CACHED_RESPONSES:
+                self.responses.popitem(last=False)
+        else:
+            METRICS.increment("service.cached")
+            self.responses.move_to_end(key)
+        return 200, body, {"ETag": etag}
+
+    async def route(self, method, target, headers, body):
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if body:
+            try:
+                body = json.loads(body)
+            except ValueError:
+                raise ApiError(400, "body is not valid JSON")
+
+        if parts == ["graph"] and method == "GET":
+            bucket = params.get("bucket", "Day")
+            if bucket not in car_lending.BUCKET_LABELS:
+                raise ApiError(400, f"bucket must be one of {', '.join(car_lending.BUCKET_LABELS)}")
+            return await self.conditional(target, headers, lending_graph, bucket)
+        if not parts or parts[0] not in TABLES or len(parts) > 2:
+            raise ApiError(404, f"no such resource: {url.path}")
+        table = parts[0]
+
+        if len(parts) == 1:
+            if method == "GET":
+                return await self.conditional(target, headers, list_rows, table, *parse_page(table, params))
+            if method == "POST":
+                return 201, await self.pool.write(insert_row, table, parse_record(table, body)), {}
+            if method == "PATCH":
+                changes = parse_record(table, body.get("changes") if isinstance(body, dict) else None, partial=True)
+                return 200, await self.pool.write(update_rows, table, parse_ids(body), changes), {}
+            if method == "DELETE":
+                return 200, await self.pool.write(delete_rows, table, parse_ids(body)), {}
+            raise ApiError(405, f"{method} is not allowed on /{table}")
+
+        try:
+            record_id = int(parts[1])
+        except ValueError:
+            raise ApiError(404, f"no such resource: {url.path}")
+        if method == "GET":
+            return await self.conditional(target, headers, get_row, table, record_id)
+        if method == "PATCH":
+            return 200, await self.pool.write(update_rows, table, [record_id], parse_record(table, body, partial=True), True), {}
+        if method == "DELETE":
+            return 200, await self.pool.write(delete_rows, table, [record_id], True), {}
+        raise ApiError(405, f"{method} is not allowed on /{table}/{record_id}")
+
+    async def respond(self, method, target, headers, body):
+        with METRICS.timer(f"service.{method.lower()}"):
+            try:
+                return await self.route(method, target, headers, body)
+            except ApiError as error:
+                return error.status, {"error": str(error)}, {}
+            except Exception as error:
+                print(f"{method} {target} failed:", repr(error))
+                return 500, {"error": str(error)}, {}
+
+    async def serve_client(self, reader, writer):
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                status, payload, extra_headers = await self.respond(method.upper(), target, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(encode_response(status, payload, extra_headers, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass #client went away or spoke something else than HTTP
+        finally:
+            del self.clients[writer]
+            writer.close()
+
+    async def close_clients(self, timeout=5):
+        """Hang up on kept-alive clients, letting requests in progress finish."""
+        tasks = list(self.clients.values())
+        for writer in list(self.clients):
+            writer.close()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+def encode_response(status, payload, headers, keep_alive):
+    if isinstance(payload, bytes): #already encoded
+        body = payload
+    else:
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if payload is not None:
+        lines.append("Content-Type: application/json")
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+async def dump_metrics(path, interval=10):
+    while True:
+        await asyncio.sleep(interval)
+        METRICS.dump(path)
+
+async def serve(args):
+    pool = ConnectionPool(args.db, args.readers)
+    service = LendingService(pool)
+    server = await asyncio.start_server(service.serve_client, args.host, args.port)
+    port = server.sockets[0].getsockname()[1]
+    stopping = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal_number, stopping.set)
+        except NotImplementedError:
+            pass #windows, where Ctrl+C raises KeyboardInterrupt instead
+    print(f"Serving {args.db} on http://{args.host}:{port} with {args.readers} readers", flush=True)
+    dumping = asyncio.create_task(dump_metrics(car_lending.METRICS_FILE)) if car_lending.METRICS_FILE else None
+    try:
+        await stopping.wait()
+    finally:
+        server.close()
+        await service.close_clients()
+        if dumping is not None:
+            dumping.cancel()
+        pool.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON service over the car lending database")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on, 0 picks a free one")
+    parser.add_argument("--readers", type=int, default=4, help="reader connections")
+    parser.add_argument("--db", default=car_lending.DB_NAME, help="database file")
+    args = parser.parse_args(argv)
+
+    app = QCoreApplication(sys.argv[:1])
+    db = car_lending.open_connection("service_setup", args.db)
+    if db is None:
+        print("Unable to open database")
+        return 1
+    car_lending.create_schema(db)
+    car_lending.migrate_db(db)
+    db.close()
+    del db
+    QSqlDatabase.removeDatabase("service_setup")
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    if car_lending.METRICS_FILE:
+        METRICS.dump(car_lending.METRICS_FILE)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
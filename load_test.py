@@ -0,0 +1,218 @@
+"""Load test of lending_service.py: requests per second at several client counts on localhost.
+
+    python load_test.py [--url URL | --db FILE] [--clients 1,8,32] [--seconds 10] [--writes 0.1] [--json FILE]
+
+Without --url a service is started on a copy of --db (the lending db by default),
+so the test's writes never reach the real data, and stopped afterwards.
+
+Every client is an asyncio task with a kept-alive connection of its own, sending
+requests back to back: table pages from random ids, single customers, the lending
+graph and, for a --writes share of the requests, new lendings (every car in turn
+on a two-day slot, so they don't conflict). A third of the reads repeat the client's
+previous GET with If-None-Match, as a terminal polling for changes would.
+Reported per client count: requests/s, latency percentiles, the share of 304
+answers and the errors.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import car_lending
+
+async def request(reader, writer, method, path, body=None, headers=None):
+    """Send one request on a kept-alive connection. Returns (status, headers, body bytes)."""
+    payload = b"" if body is None else json.dumps(body).encode("utf-8")
+    head = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Content-Length: {len(payload)}"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("service closed the connection")
+    response_headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+    content = await reader.readexactly(int(response_headers.get("content-length") or 0))
+    return int(status_line.split()[1]), response_headers, content
+
+async def highest_id(host, port, table):
+    """Largest id of a table, found by bisecting with one-row pages."""
+    reader, writer = await asyncio.open_connection(host, port)
+    low, high = 0, 1
+    while True:
+        _, _, content = await request(reader, writer, "GET", f"/{table}?after={high}&limit=1")
+        if not json.loads(content)["rows"]:
+            break
+        low, high = high, high * 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        _, _, content = await request(reader, writer, "GET", f"/{table}?after={middle}&limit=1")
+        if json.loads(content)["rows"]:
+            low = middle
+        else:
+            high = middle
+    writer.close()
+    return high if low else 0
+
+class Workload:
+    """What the clients send, shared by all of them."""
+
+    def __init__(self, max_ids, write_share, seed):
+        self.max_ids = max_ids
+        self.write_share = write_share
+        self.random = random.Random(seed)
+        #new lendings take every car in turn on a two-day slot, far after any real lending, then
+        #move to the next slot; one date per write would keep growing the graph being measured
+        self.first_day = datetime.date(2300, 1, 1).toordinal() + self.random.randrange(0, 1_000_000, 2)
+        self.written = 0
+
+    def next_request(self, last_get):
+        """(method, path, body, headers) of a client's next request."""
+        pick = self.random.random()
+        if pick < self.write_share and self.max_ids["customers"] and self.max_ids["cars"]:
+            slot, car = divmod(self.written, self.max_ids["cars"])
+            day = self.first_day + 2 * slot
+            self.written += 1
+            lending = {"customer_id": self.random.randint(1, self.max_ids["customers"]), "car_id": car + 1,
+                       "lending_date": datetime.date.fromordinal(day).isoformat(),
+                       "return_date": datetime.date.fromordinal(day + 1).isoformat()}
+            return "POST", "/lendings", lending, None
+        if last_get is not None and self.random.random() < 1 / 3:
+            path, etag = last_get
+            return "GET", path, None, {"If-None-Match": etag}
+        pick = self.random.random()
+        if pick < 0.5:
+            path = f"/lendings?after={self.random.randint(0, self.max_ids['lendings'])}&limit=50"
+        elif pick < 0.8:
+            path = f"/customers/{self.random.randint(1, max(1, self.max_ids['customers']))}"
+        else:
+            path = "/graph"
+        return "GET", path, None, None
+
+async def client(host, port, workload, deadline, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    last_get = None
+    try:
+        while time.perf_counter() < deadline:
+            method, path, body, headers = workload.next_request(last_get)
+            start = time.perf_counter()
+            status, response_headers, _ = await request(reader, writer, method, path, body, headers)
+            results["latencies"].append(time.perf_counter() - start)
+            results["statuses"][status] = results["statuses"].get(status, 0) + 1
+            if method == "GET" and "etag" in response_headers:
+                last_get = (path, response_headers["etag"])
+    except (ConnectionError, asyncio.IncompleteReadError) as error:
+        results["errors"].append(str(error))
+    finally:
+        writer.close()
+
+async def run_level(host, port, workload, clients, seconds):
+    results = {"latencies": [], "statuses": {}, "errors": []}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, workload, start + seconds, results) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(results["latencies"])
+    count = len(latencies)
+
+    def percentile(share):
+        return round(latencies[min(count - 1, int(count * share))] * 1000, 3) if count else None
+
+    failed = sum(number for status, number in results["statuses"].items() if status >= 400 and status != 409)
+    return {
+        "clients": clients,
+        "requests": count,
+        "requests_per_s": round(count / elapsed, 1),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if count else None,
+        "not_modified_share": round(results["statuses"].get(304, 0) / count, 3) if count else 0.0,
+        "conflicts": results["statuses"].get(409, 0),
+        "failed": failed + len(results["errors"]),
+        "statuses": {str(status): number for status, number in sorted(results["statuses"].items())},
+    }
+
+async def run_load_test(host, port, args):
+    max_ids = {table: await highest_id(host, port, table) for table in car_lending.IMPORT_COLUMNS}
+    workload = Workload(max_ids, args.writes, args.seed)
+    levels = []
+    for clients in args.clients:
+        level = await run_level(host, port, workload, clients, args.seconds)
+        print(f"{clients:>4} clients: {level['requests_per_s']:>9} req/s, p50 {level['p50_ms']} ms, p95 {level['p95_ms']} ms, "
+              f"p99 {level['p99_ms']} ms, {level['not_modified_share']:.0%} not modified, {level['failed']} failed", flush=True)
+        levels.append(level)
+    return {"max_ids": max_ids, "levels": levels}
+
+def start_service(db_path, readers):
+    """Start lending_service.py on a free port. Returns (process, host, port)."""
+    service = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lending_service.py")
+    process = subprocess.Popen([sys.executable, service, "--db", db_path, "--port", "0", "--readers", str(readers)],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if "http://" not in line:
+        process.kill()
+        raise RuntimeError(f"lending service did not start: {line.strip()}")
+    url = urlsplit(line.split()[line.split().index("on") + 1])
+    return process, url.hostname, url.port
+
+def stop_service(process):
+    if os.name == "nt":
+        process.terminate()
+    else:
+        process.send_signal(signal.SIGINT) #lets the service close its connections
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Requests per second of lending_service.py at several client counts")
+    parser.add_argument("--url", help="service to test; without it one is started on a copy of --db")
+    parser.add_argument("--db", default=car_lending.DB_NAME, help="database copied for the started service")
+    parser.add_argument("--readers", type=int, default=4, help="reader connections of the started service")
+    parser.add_argument("--clients", type=lambda text: [int(number) for number in text.split(",")], default=[1, 8, 32],
+                        help="comma separated client counts")
+    parser.add_argument("--seconds", type=float, default=10.0, help="duration per client count")
+    parser.add_argument("--writes", type=float, default=0.1, help="share of requests inserting a lending")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    process = scratch = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        scratch = tempfile.mkdtemp(prefix="lending_load_")
+        db_path = os.path.join(scratch, "lendings.db")
+        shutil.copyfile(args.db, db_path)
+        process, host, port = start_service(db_path, args.readers)
+    try:
+        result = asyncio.run(run_load_test(host, port, args))
+    finally:
+        if process is not None:
+            stop_service(process)
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    result.update({"url": args.url, "readers": None if args.url else args.readers, "seconds": args.seconds, "write_share": args.writes})
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+    return 1 if any(level["failed"] for level in result["levels"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
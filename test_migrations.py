@@ -0,0 +1,39 @@
+import pytest
+from PyQt6.QtCore import QCoreApplication
+from PyQt6.QtSql import QSqlQuery
+
+import car_lending
+
+@pytest.fixture
+def db(tmp_path):
+    app = QCoreApplication.instance() or QCoreApplication([])
+    db = car_lending.open_connection("migration_test", str(tmp_path / "lendings.db"))
+    assert db is not None
+    car_lending.create_schema(db)
+    yield db
+    db.close()
+
+def rows(db, sql):
+    query = QSqlQuery(sql, db)
+    result = []
+    while query.next():
+        result.append(tuple(query.value(i) for i in range(query.record().count())))
+    return result
+
+def test_duplicate_emails_do_not_block_later_migrations(db):
+    QSqlQuery("INSERT INTO customers (name, email) VALUES ('Ann', 'ann@example.com'), ('Anne', 'ann@example.com')", db)
+    QSqlQuery("INSERT INTO cars (make, model, year) VALUES ('Fiat', 'Panda', 2010)", db)
+    QSqlQuery("INSERT INTO lendings (customer_id, car_id, lending_date, return_date) VALUES (1, 1, '03.02.2024', '05.02.2024')", db)
+
+    assert car_lending.migrate_db(db) == len(car_lending.SCHEMA_MIGRATIONS)
+    assert car_lending.deferred_migrations(db) == [2]
+    assert rows(db, "SELECT lending_date, return_date FROM lendings") == [("2024-02-03", "2024-02-05")]
+    assert rows(db, "SELECT lending_date, lendings FROM lending_daily_counts") == [("2024-02-03", 1)]
+    assert rows(db, "SELECT rowid FROM customers_fts WHERE customers_fts MATCH 'anne'") == [(2,)]
+    assert rows(db, "SELECT name FROM sqlite_master WHERE name = 'idx_customers_email'") == []
+
+    #once the duplicates are gone the deferred migration runs on the next start
+    QSqlQuery("UPDATE customers SET email = 'anne@example.com' WHERE id = 2", db)
+    assert car_lending.migrate_db(db) == len(car_lending.SCHEMA_MIGRATIONS)
+    assert car_lending.deferred_migrations(db) == []
+    assert rows(db, "SELECT name FROM sqlite_master WHERE name = 'idx_customers_email'") == [("idx_customers_email",)]